@@ -0,0 +1,411 @@
+"""Benchmark suite for the Switch Register pipeline in "switch aditya.py".
+
+Generates synthetic Switch Registers (the OUTPUT_COLUMNS input schema, or the legacy
+From / Scheme : layout that needs the RTA Master), RTA Masters and multi-file Brokerage
+Structures with overlapping investment periods, then runs the pipeline once per size in a
+fresh process and reports throughput and peak memory per stage.
+
+    python benchmarks/switch_benchmark.py --sizes 10k,100k,1m
+    python benchmarks/switch_benchmark.py --sizes 100k --baseline old_switch.py
+    python benchmarks/switch_benchmark.py --sizes 10k,100k --json results.json
+    python benchmarks/switch_benchmark.py --sizes 10k,100k --expect results.json
+
+--baseline runs another copy of the script (e.g. `git show <rev>:"switch aditya.py" > old_switch.py`)
+on the same inputs and requires byte-identical output. Revisions without SwitchEngine, including the
+original GUI-only script, are driven through SwitchRegisterGUI.process_files with stubbed dialogs
+(reported as one 'GUI pipeline' stage). --expect compares output digests against a previous --json
+run, so regressions are caught without keeping the old script.
+Generated inputs are cached in the work directory per size, seed and layout.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import types
+from importlib.machinery import SourceFileLoader
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SWITCH_SCRIPT = os.path.join(REPO_DIR, 'switch aditya.py')
+DEFAULT_SIZES = '10k,100k,1m'
+LAYOUTS = ('inout', 'legacy')
+
+# Reference data shapes, roughly one large AMC
+SCHEME_COUNT = 2000
+SUBFUND_COUNT = 60
+BROKERAGE_FILES = 3           # one per brokerage revision, periods overlap across files
+SUBFUNDS_PER_BROKER = 30
+DIRECT_SHARE = 0.03           # share of switches with a 'DIRECT' broker (removed by the pipeline)
+UNKNOWN_BROKER_SHARE = 0.10   # brokers absent from the Brokerage Structure
+FIRST_TRADE_DATE = pd.Timestamp('2023-04-01')
+TRADE_DAYS = 900
+
+
+def parse_size(text):
+    """'10k' / '2.5m' / '5000' -> row count"""
+    text = text.strip().lower()
+    scale = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def format_size(rows):
+    """Row count -> short label ('10k', '5m')"""
+    for suffix, scale in (('m', 10 ** 6), ('k', 10 ** 3)):
+        if rows >= scale and rows % scale == 0:
+            return f'{rows // scale}{suffix}'
+    return str(rows)
+
+
+def load_switch_module(path, name='switch_aditya'):
+    """Import a copy of "switch aditya.py" as a module (registered so process pools can pickle its functions).
+    Its own directory, then the repository, go on sys.path, as when the script is run directly, so
+    its sibling modules (input_cache) import"""
+    for directory in (REPO_DIR, os.path.dirname(os.path.abspath(path))):
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_loader(name, SourceFileLoader(name, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _codes(prefix, numbers, width):
+    """Vectorized 'PREFIX000123' codes"""
+    return prefix + pd.Series(numbers).astype(str).str.zfill(width)
+
+
+def _date_strings(rng, n, first, days):
+    """n dd/mm/YYYY strings in [first, first + days), formatted once per distinct day"""
+    distinct = (first + pd.to_timedelta(np.arange(days), unit='D')).strftime('%d/%m/%Y').to_numpy()
+    return distinct[rng.integers(0, days, n)]
+
+
+def generate_rta_master(rng):
+    """RTA Master: Regular/Direct plan pairs per fund, each scheme mapped to a parent subfund and asset class"""
+    fund = np.arange(SCHEME_COUNT) // 2
+    plan = np.where(np.arange(SCHEME_COUNT) % 2, 'Regular', 'Direct')
+    option = rng.choice(['Growth', 'IDCW Payout', 'IDCW Reinvestment'], SCHEME_COUNT, p=[0.7, 0.2, 0.1])
+    return pd.DataFrame({
+        'Scheme_code': _codes('S', np.arange(SCHEME_COUNT), 5),
+        'PARENT_SUB_FUND_CODE': _codes('SF', fund % SUBFUND_COUNT, 4),
+        'ASSET_CLASS': rng.choice(['EQUITY', 'DEBT', 'HYBRID', 'LIQUID'], SCHEME_COUNT, p=[0.5, 0.25, 0.15, 0.1]),
+        'PLAN': plan,
+        'OPTION': option,
+        'SCHEME_NAME': 'Fund ' + pd.Series(fund).astype(str) + ' ' + plan + ' Plan ' + option,
+    })
+
+
+def broker_codes(rows):
+    """ARN codes for a register of this size (more distributors in bigger registers)"""
+    return _codes('ARN-', np.arange(int(np.clip(rows // 20, 200, 20000))), 6).to_numpy()
+
+
+def generate_brokerage_files(rng, brokers):
+    """Brokerage Structure revisions: each broker/subfund has a rate period in every file, and the
+    periods of consecutive files overlap by six months. Rates mix numbers, 'x.xx%' text and blanks."""
+    subfunds = _codes('SF', np.arange(SUBFUND_COUNT), 4).to_numpy()
+    per_broker = min(SUBFUNDS_PER_BROKER, SUBFUND_COUNT)
+    broker_col = np.repeat(brokers, per_broker)
+    subfund_col = subfunds[np.argsort(rng.random((len(brokers), SUBFUND_COUNT)), axis=1)[:, :per_broker].ravel()]
+    files = []
+    for revision in range(BROKERAGE_FILES):
+        period_from = FIRST_TRADE_DATE + pd.DateOffset(months=12 * revision)
+        period_to = period_from + pd.DateOffset(months=18) - pd.Timedelta(days=1)
+        df = pd.DataFrame({
+            'Cons Code': broker_col,
+            'Scheme Code': subfund_col,
+            'Investment Period From': period_from.strftime('%d/%m/%Y'),
+            'Investment Period To': period_to.strftime('%d/%m/%Y'),
+        })
+        for year in range(1, 6):
+            rates = rng.choice([0.25, 0.5, 0.75, 1.0, 1.25], len(df)).astype(object)
+            as_text = rng.random(len(df)) < 0.2
+            rates[as_text] = [f'{rate:.2f}%' for rate in rates[as_text]]
+            rates[rng.random(len(df)) < 0.05 * year] = np.nan
+            df[f'Trail Rate {year} Year'] = rates
+        files.append(df)
+    return files
+
+
+def generate_switch_register(rng, rows, rta_df, brokers, switch_module, layout='inout'):
+    """Switch Register with the OUTPUT_COLUMNS input schema ('inout'), or the legacy From / Scheme : layout"""
+    scheme_in = rng.integers(0, len(rta_df), rows)
+    scheme_out = rng.integers(0, len(rta_df), rows)
+    unknown = _codes('ARN-X', np.arange(max(len(brokers) // 10, 1)), 5).to_numpy()
+
+    def pick_brokers():
+        picked = brokers[rng.integers(0, len(brokers), rows)].astype(object)
+        draw = rng.random(rows)
+        picked[draw < UNKNOWN_BROKER_SHARE] = unknown[rng.integers(0, len(unknown), int((draw < UNKNOWN_BROKER_SHARE).sum()))]
+        picked[draw > 1 - DIRECT_SHARE] = 'DIRECT'
+        return picked
+
+    trade_dates = _date_strings(rng, rows, FIRST_TRADE_DATE, TRADE_DAYS)
+    codes = rta_df['Scheme_code'].to_numpy()
+    if layout == 'legacy':
+        return pd.DataFrame({
+            'SL_NO': np.arange(1, rows + 1),
+            'From': codes[scheme_out] + '/' + rta_df['SCHEME_NAME'].to_numpy()[scheme_out],
+            'Scheme :': codes[scheme_in] + '/' + rta_df['SCHEME_NAME'].to_numpy()[scheme_in],
+            'BROK_DLR_N': pick_brokers(),
+            'Tran Date': trade_dates,
+        })
+
+    subfund = rta_df['PARENT_SUB_FUND_CODE'].to_numpy()
+    asset = rta_df['ASSET_CLASS'].to_numpy()
+    name = rta_df['SCHEME_NAME'].to_numpy()
+    columns = {
+        'SL_NO': np.arange(1, rows + 1),
+        'FOLIO_NO': rng.integers(10 ** 9, 10 ** 10, rows),
+        'INVESTOR_F': _codes('INV', rng.integers(0, rows, rows), 8).to_numpy(),
+        'USER_TRXNN': rng.integers(10 ** 8, 10 ** 9, rows),
+        'OUT_TRXN_N': rng.integers(10 ** 8, 10 ** 9, rows),
+        'SO_ASSET_C': asset[scheme_out],
+        'OUT_SUBFUN': subfund[scheme_out],
+        'OUT_SCHEME': codes[scheme_out],
+        'OUT_SCHEM0': name[scheme_out],
+        'OUT_TRADE_': trade_dates,
+        'OUT_BROKER': pick_brokers(),
+        'OUT_BROKE1': 'B',
+        'SO_UNITS': np.round(rng.random(rows) * 1000, 3),
+        'SO_AMOUNT': np.round(rng.random(rows) * 5e5, 2),
+        'IN_SUBFUND': subfund[scheme_in],
+        'IN_SCHEME': codes[scheme_in],
+        'IN_SCHEME_': name[scheme_in],
+        'SI_ASSET_C': asset[scheme_in],
+        'IN_TRADE_D': trade_dates,
+        'IN_BROKER': pick_brokers(),
+        'SI_UNITS': np.round(rng.random(rows) * 1000, 3),
+        'SI_AMOUNT': np.round(rng.random(rows) * 5e5, 2),
+    }
+    # Input columns are the OUTPUT_COLUMNS that precede the derived ones
+    input_columns = switch_module.OUTPUT_COLUMNS[:switch_module.OUTPUT_COLUMNS.index('IN ASSET_CLASS')]
+    return pd.DataFrame({col: columns[col] for col in input_columns})
+
+
+def write_dataset(directory, rows, seed, layout, switch_module):
+    """Generate (once) and return the input paths for one size: switch, rta, [brokerage...]"""
+    os.makedirs(directory, exist_ok=True)
+    rta_path = os.path.join(directory, 'rta_master.csv')
+    switch_path = os.path.join(directory, f'switch_register_{layout}.csv')
+    brokerage_paths = [os.path.join(directory, f'brokerage_{i + 1}.csv') for i in range(BROKERAGE_FILES)]
+    if all(os.path.isfile(path) for path in [rta_path, switch_path] + brokerage_paths):
+        return switch_path, rta_path, brokerage_paths
+
+    rng = np.random.default_rng(seed)
+    rta_df = generate_rta_master(rng)
+    brokers = broker_codes(rows)
+    rta_df.to_csv(rta_path, index=False)
+    for path, df in zip(brokerage_paths, generate_brokerage_files(rng, brokers)):
+        df.to_csv(path, index=False)
+    generate_switch_register(rng, rows, rta_df, brokers, switch_module, layout).to_csv(switch_path + '.tmp', index=False)
+    os.replace(switch_path + '.tmp', switch_path)
+    return switch_path, rta_path, brokerage_paths
+
+
+class _GuiStub:
+    """Stand-in for the SwitchRegisterGUI instance: the uploaded paths, a root whose after() runs the
+    callback at once, and inert widgets / unchecked checkboxes for anything else process_files reads"""
+
+    def __init__(self, switch_path, rta_path, brokerage_paths):
+        self.switch_register_path = switch_path
+        self.rta_master_path = rta_path
+        self.brokerage_structure_paths = list(brokerage_paths)
+        self.root = types.SimpleNamespace(after=lambda delay, callback: callback())
+
+    def __getattr__(self, name):
+        return types.SimpleNamespace(get=lambda: False, configure=lambda **kwargs: None)
+
+
+class _SyncThread:
+    """threading.Thread stand-in that runs its target in start()"""
+
+    def __init__(self, target, **kwargs):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+def run_gui_pipeline(sw, switch_path, rta_path, brokerage_paths, output_path):
+    """Drive a script without SwitchEngine (the original GUI-only one) through
+    SwitchRegisterGUI.process_files: dialogs answer with output_path, the worker thread runs inline and
+    errors shown to the user are raised. Returns a RunStats with the whole run as one stage."""
+    errors = []
+    sw.filedialog = types.SimpleNamespace(asksaveasfilename=lambda **kwargs: output_path)
+    sw.messagebox = types.SimpleNamespace(
+        showinfo=lambda title, message: None,
+        showwarning=lambda title, message: print(f"{title}: {message}"),
+        showerror=lambda title, message: errors.append(f"{title}: {message}"),
+    )
+    sw.LoadingWindow = lambda parent: types.SimpleNamespace(update_status=lambda status: None, stop=lambda: None)
+    sw.threading = types.SimpleNamespace(Thread=_SyncThread)
+    sw.time = types.SimpleNamespace(sleep=lambda seconds: None)
+
+    stats = load_switch_module(SWITCH_SCRIPT, 'switch_benchmark_stats').RunStats()
+    rows_in = len(pd.read_csv(switch_path, usecols=[0]))
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    stage = stats.start('GUI pipeline', rows_in=rows_in)
+    sw.SwitchRegisterGUI.process_files(_GuiStub(switch_path, rta_path, brokerage_paths))
+    if errors:
+        raise RuntimeError('\n'.join(errors))
+    if not os.path.isfile(output_path):
+        raise RuntimeError(f"{output_path} was not written")
+    stats.stop(stage, rows_out=len(pd.read_csv(output_path, usecols=[0])))
+    return stats
+
+
+def run_pipeline(script, switch_path, rta_path, brokerage_paths, output_path, cache_dir):
+    """Run the headless engine the way the GUI does, returning its RunStats (inputs read cold, index compiled)"""
+    sw = load_switch_module(script)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    sw.CACHE_DIR = cache_dir
+    sw.BROKERAGE_INDEX_DIR = os.path.join(cache_dir, 'brokerage_index')
+    sw.INPUT_CACHE_DIR = os.path.join(cache_dir, 'inputs')
+    if not hasattr(sw, 'SwitchEngine'):
+        return run_gui_pipeline(sw, switch_path, rta_path, brokerage_paths, output_path)
+    return sw.SwitchEngine(brokerage_paths, rta_path).run(switch_path, output_path)['stats']
+
+
+def file_digest(path):
+    """SHA-256 of an output file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_in_child(script, dataset, output_path, stats_path, cache_dir):
+    """Run one pipeline in a fresh interpreter, so its peak RSS is not inflated by earlier runs"""
+    switch_path, rta_path, brokerage_paths = dataset
+    command = [sys.executable, os.path.abspath(__file__), '--child', script, switch_path, rta_path,
+               output_path, stats_path, cache_dir] + list(brokerage_paths)
+    with open(os.devnull, 'w') as devnull:
+        result = subprocess.run(command, stdout=devnull, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Pipeline run failed for {script}:\n{result.stderr[-2000:]}")
+    with open(stats_path, encoding='utf-8') as f:
+        return pd.DataFrame(json.load(f)['stages'])
+
+
+def stage_report(stages):
+    """Add throughput (input rows per second) to a stage table"""
+    report = stages[['stage', 'calls', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'matched']].copy()
+    rows = report['rows_in'].fillna(report['rows_out'])
+    report['rows_per_s'] = (rows / report['wall_s'].where(report['wall_s'] > 0)).round(0).astype('Int64')
+    return report
+
+
+def describe_differences(path_a, path_b):
+    """Describe how two output CSVs differ: columns only in one of them, then every shared column
+    with differing values (row count and the first differing row), so intended changes can be told
+    apart from regressions when comparing against an older script"""
+    a = pd.read_csv(path_a, dtype=str, keep_default_na=False)
+    b = pd.read_csv(path_b, dtype=str, keep_default_na=False)
+    lines = []
+    only_a = [col for col in a.columns if col not in b.columns]
+    only_b = [col for col in b.columns if col not in a.columns]
+    if only_a:
+        lines.append(f"only in {os.path.basename(path_a)}: {only_a}")
+    if only_b:
+        lines.append(f"only in {os.path.basename(path_b)}: {only_b}")
+    if len(a) != len(b):
+        lines.append(f"row counts differ: {len(a)} vs {len(b)}")
+        return '\n'.join(lines)
+    for col in [col for col in a.columns if col in b.columns]:
+        differs = (a[col] != b[col]).to_numpy()
+        if differs.any():
+            row = int(np.flatnonzero(differs)[0])
+            lines.append(f"'{col}': {int(differs.sum())} rows differ, first at row {row}: "
+                         f"{a[col].iloc[row]!r} vs {b[col].iloc[row]!r}")
+    if not lines:
+        lines.append("same values, different bytes (encoding or formatting)")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Switch Register pipeline on synthetic data")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="comma-separated register sizes, e.g. 10k,100k,1m,5m")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', choices=LAYOUTS, default='inout',
+                        help="'inout': IN/OUT code columns; 'legacy': From / Scheme : columns mapped via the RTA Master")
+    parser.add_argument('--script', default=SWITCH_SCRIPT, help="switch script to benchmark")
+    parser.add_argument('--baseline', help="another copy of the switch script; outputs must be byte-identical")
+    parser.add_argument('--expect', help="results JSON from an earlier --json run; output digests must match")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'switch_benchmark'))
+    parser.add_argument('--json', dest='json_path', help="write per-size stage tables and output digests here")
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        script, switch_path, rta_path, output_path, stats_path, cache_dir, *brokerage_paths = args.child
+        run_pipeline(script, switch_path, rta_path, brokerage_paths, output_path, cache_dir).to_json(stats_path)
+        return 0
+
+    expected = {}
+    if args.expect:
+        with open(args.expect, encoding='utf-8') as f:
+            expected = {run['label']: run['output_sha256'] for run in json.load(f)['runs']}
+
+    generator_module = load_switch_module(os.path.abspath(args.script), 'switch_benchmark_target')
+    results = []
+    failures = 0
+    for rows in [parse_size(size) for size in args.sizes.split(',') if size.strip()]:
+        label = f'{format_size(rows)}_{args.layout}_seed{args.seed}'
+        dataset_dir = os.path.join(args.workdir, 'data', f'{format_size(rows)}_seed{args.seed}')
+        print(f"\n=== {label}: generating inputs (cached in {dataset_dir}) ===")
+        dataset = write_dataset(dataset_dir, rows, args.seed, args.layout, generator_module)
+
+        runs = {'current': os.path.abspath(args.script)}
+        if args.baseline:
+            runs['baseline'] = os.path.abspath(args.baseline)
+        outputs = {}
+        for name, script in runs.items():
+            output_path = os.path.join(args.workdir, 'out', f'{label}_{name}.csv')
+            stats_path = os.path.join(args.workdir, 'out', f'{label}_{name}_stats.json')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            stages = run_in_child(script, dataset, output_path, stats_path,
+                                  os.path.join(args.workdir, 'cache', name))
+            outputs[name] = output_path
+            report = stage_report(stages)
+            print(f"\n=== {label} [{name}] total {report['wall_s'].sum():.2f}s, "
+                  f"peak RSS {report['peak_rss_mb'].max()} MB ===")
+            print(report.to_string(index=False))
+            if name == 'current':
+                results.append({'label': label, 'rows': rows, 'output_sha256': file_digest(output_path),
+                                'stages': json.loads(report.to_json(orient='records'))})
+
+        digest = results[-1]['output_sha256']
+        if args.baseline:
+            if file_digest(outputs['baseline']) == digest:
+                print(f"\n=== {label}: output matches baseline ===")
+            else:
+                failures += 1
+                print(f"\n=== {label}: OUTPUT DIFFERS FROM BASELINE ===")
+                print(describe_differences(outputs['baseline'], outputs['current']))
+        if label in expected:
+            if expected[label] == digest:
+                print(f"\n=== {label}: output digest matches {args.expect} ===")
+            else:
+                failures += 1
+                print(f"\n=== {label}: OUTPUT DIGEST DIFFERS FROM {args.expect} ===")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'script': os.path.abspath(args.script), 'seed': args.seed, 'runs': results}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Content-addressed Feather cache for parsed inputs, shared by "switch aditya.py" and "ADITYA MISS.PY".
+
+Each script keeps its own cache directory and size limit and passes them in; entries are one
+directory per input, holding the frame written by save_frame. Needs pyarrow to cache anything.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+
+def file_sha256(path):
+    """SHA-256 of a file's bytes, read in 1 MB blocks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def evict(cache_dir, max_bytes):
+    """Drop least recently used cache entries until cache_dir holds at most max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        # <key>.tmp<pid> directories are still being written by some process
+        if os.path.isdir(entry) and '.tmp' not in name:
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def save_frame(df, directory, **meta):
+    """Write a DataFrame exactly into directory as Feather (extra meta goes to meta.json).
+
+    Columns are stored under positional names, since real headers may be non-strings or
+    duplicates, which Feather rejects; mixed-type object columns (codes that are sometimes
+    numbers, dates next to 'Not Found') are kept exactly via pickle. Needs pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    stored = df.reset_index(drop=True)
+    stored.columns = [f'c{i}' for i in range(len(df.columns))]
+    pickled = []
+    try:
+        table = pa.Table.from_pandas(stored, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        for col in stored.columns:
+            try:
+                pa.array(stored[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pickled.append(col)
+        table = pa.Table.from_pandas(stored.drop(columns=pickled), preserve_index=False)
+    os.makedirs(directory, exist_ok=True)
+    feather.write_feather(table, os.path.join(directory, 'data.feather'), compression='uncompressed')
+    if pickled:
+        stored[pickled].to_pickle(os.path.join(directory, 'extra.pkl'))
+    pd.to_pickle(list(df.columns), os.path.join(directory, 'columns.pkl'))
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, columns=len(df.columns), pickled=pickled), f)
+
+
+def load_frame(directory):
+    """Read a DataFrame written by save_frame"""
+    import pyarrow.feather as feather
+    with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    df = feather.read_table(os.path.join(directory, 'data.feather'), memory_map=True).to_pandas()
+    if meta['pickled']:
+        extra = pd.read_pickle(os.path.join(directory, 'extra.pkl'))
+        for col in meta['pickled']:
+            df[col] = extra[col].to_numpy()
+    df = df[[f'c{i}' for i in range(meta['columns'])]]
+    df.columns = pd.Index(pd.read_pickle(os.path.join(directory, 'columns.pkl')))
+    return df
+
+
+def cached_read(cache_dir, max_bytes, path, reader, **options):
+    """reader(path, **options) through a content-addressed cache in cache_dir.
+
+    The key is the file's SHA-256 plus the reader name, its options and the pandas
+    version, so an edited file or a different usecols never hits a stale entry. Anything
+    the reader would otherwise pick for itself, such as the Excel engine, must be passed
+    in options so it is part of the key. Hits refresh the entry's mtime (LRU); the
+    cache is trimmed to max_bytes after each write. Without pyarrow, or for frames
+    Arrow cannot hold, it just reads.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return reader(path, **options)
+
+    key_source = json.dumps([file_sha256(path), reader.__name__, options, pd.__version__], sort_keys=True, default=str)
+    entry = os.path.join(cache_dir, hashlib.sha256(key_source.encode()).hexdigest())
+    if os.path.isfile(os.path.join(entry, 'meta.json')):
+        try:
+            df = load_frame(entry)
+            os.utime(entry)
+            return df
+        except (OSError, ValueError, KeyError, pa.ArrowException):
+            shutil.rmtree(entry, ignore_errors=True)
+
+    df = reader(path, **options)
+    try:
+        tmp = f'{entry}.tmp{os.getpid()}'
+        save_frame(df, tmp, source=os.path.basename(path))
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        evict(cache_dir, max_bytes)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        print(f"Warning: could not cache {os.path.basename(path)}: {e}")
+    return df
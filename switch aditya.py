@@ -8,6 +8,1993 @@ import time
 import os
 from datetime import datetime
 import calendar
+import numpy as np
+import hashlib
+import json
+import shutil
+import functools
+import concurrent.futures
+import multiprocessing
+import sys
+import argparse
+import importlib.util
+import input_cache
+from input_cache import file_sha256, save_frame, load_frame
+
+# Compiled brokerage indexes live here, one directory per content hash of the uploaded files
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.switch_register_cache')
+BROKERAGE_INDEX_DIR = os.path.join(CACHE_DIR, 'brokerage_index')
+BROKERAGE_INDEX_VERSION = 3
+BROKERAGE_INDEX_KEEP = 8  # Most recent compiled indexes kept on disk
+RATE_STATUS_CATEGORIES = ['Found', 'Rate Missing', 'Not Found']
+# Parsed Switch Register / RTA Master / Brokerage inputs, keyed by file content and reader options
+INPUT_CACHE_DIR = os.path.join(CACHE_DIR, 'inputs')
+INPUT_CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Workbook formats read with calamine when python-calamine is installed (openpyxl / xlrd / pyxlsb otherwise)
+CALAMINE_EXTENSIONS = ('.xlsx', '.xlsm', '.xlsb', '.xls', '.ods')
+# Arrow CSV ingest: pd.read_csv's default NA strings, and the size from which files are memory-mapped
+CSV_NULL_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                   '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+CSV_MEMORY_MAP_BYTES = 64 * 1024 ** 2
+# Incremental mode: processed rows of earlier runs, one store per Brokerage Structure / RTA Master / register layout
+RESULT_STORE_DIR = os.path.join(CACHE_DIR, 'results')
+RESULT_STORE_VERSION = 4  # bump whenever process_switch_rows changes what it writes
+RESULT_STORE_KEEP = 8  # Most recent result stores kept on disk
+RESULT_KEY_COLUMNS = ('SL_NO', 'USER_TRXNN')  # row identity, together with RESULT_DATE_COLUMN
+RESULT_DATE_COLUMN = 'OUT_TRADE_'
+
+
+def _datetime_to_us(values):
+    """Convert datetime-like values to int64 microseconds since epoch plus a validity mask"""
+    dt = pd.to_datetime(pd.Series(values), errors='coerce')
+    valid = dt.notna().to_numpy()
+    us = np.zeros(len(dt), dtype=np.int64)
+    if valid.any():
+        us[valid] = dt[valid].dt.as_unit('us').to_numpy().astype(np.int64)
+    return us, valid
+
+
+def distinct_values(values):
+    """Factorize a Series into (codes, uniques Series), keeping NaN as a value of its own; categoricals reuse their codes"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    if isinstance(uniques, pd.Categorical):
+        uniques = uniques.astype(uniques.categories.dtype)
+    return codes, pd.Series(uniques)
+
+
+def map_distinct(values, transform):
+    """Apply a Series -> Series transform once per distinct value and broadcast it back as a categorical"""
+    codes, uniques = distinct_values(values)
+    mapped_codes, mapped_uniques = pd.factorize(transform(uniques))
+    return pd.Series(pd.Categorical.from_codes(mapped_codes[codes], categories=mapped_uniques),
+                     index=values.index, name=values.name)
+
+
+def mask_distinct(values, predicate):
+    """Evaluate a Series -> bool Series predicate once per distinct value, as a row-aligned numpy mask"""
+    codes, uniques = distinct_values(values)
+    return predicate(uniques).to_numpy(dtype=bool)[codes]
+
+
+def categorize(values):
+    """Store a low-cardinality text column as a categorical (numeric and categorical columns are left as they are)"""
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_numeric_dtype(values.dtype):
+        return values
+    return values.astype('category')
+
+
+def parse_trail_rate(values):
+    """Parse trail rate values ('0.5', '0.50%', '1,000') to float64, NaN where not numeric"""
+    text = pd.Series(values).astype(str).str.strip().str.replace('%', '', regex=False).str.replace(',', '', regex=False)
+    return pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def detect_brokerage_columns(columns):
+    """Find Cons Code, Scheme Code, Investment Period From/To and Trail Rate 1-5 year columns"""
+    found = {
+        'cons_code': None,
+        'scheme_code': None,
+        'period_from': None,
+        'period_to': None,
+        'trail_rates': {},
+    }
+    for col in columns:
+        try:
+            col_upper = str(col).upper().strip()
+            # More flexible matching for Cons Code
+            if 'CONS' in col_upper and 'CODE' in col_upper:
+                found['cons_code'] = col
+            elif col_upper == 'CONS_CODE' or col_upper == 'CONS':
+                found['cons_code'] = col
+            # More flexible matching for Scheme Code
+            elif 'SCHEME' in col_upper and 'CODE' in col_upper:
+                found['scheme_code'] = col
+            elif col_upper == 'SCHEME_CODE' or (col_upper == 'SCHEME' and found['scheme_code'] is None):
+                found['scheme_code'] = col
+            # Investment Period From
+            elif 'INVESTMENT' in col_upper and 'PERIOD' in col_upper and 'FROM' in col_upper:
+                found['period_from'] = col
+            # Investment Period To
+            elif 'INVESTMENT' in col_upper and 'PERIOD' in col_upper and 'TO' in col_upper:
+                found['period_to'] = col
+            # Trail Rate columns (1 to 5 year)
+            elif 'TRAIL' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
+                for year in range(1, 6):
+                    if str(year) in col_upper:
+                        found['trail_rates'][year] = col
+                        break
+        except (TypeError, AttributeError):
+            # Skip columns that can't be converted to string or checked
+            continue
+    return found
+
+
+def brokerage_content_key(paths):
+    """Content hash of the Brokerage Structure files (in upload order) plus the index format version"""
+    h = hashlib.sha256(f'brokerage-index-v{BROKERAGE_INDEX_VERSION}'.encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class BrokerageIndex:
+    """Sorted interval index over the Brokerage Structure for vectorized trail-rate lookups.
+
+    Rows are grouped by (Cons Code, Scheme Code). For every key the Investment Period
+    From/To boundaries are cut into elementary segments, and each segment records the
+    first brokerage row (in file order) whose period covers it. A lookup is then one
+    composite searchsorted over all keys, so "first matching period wins" holds even
+    when periods overlap.
+
+    All state is plain numpy arrays, so a compiled index can be saved once per set of
+    brokerage files and memory-mapped on later runs instead of re-parsing the workbooks.
+    """
+
+    ARRAYS = ('keys_cons', 'keys_scheme', 'key_first_row', 'key_has_period',
+              'seg_times', 'seg_key', 'seg_row', 'seg_composite')
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.columns = meta['columns']
+        self.columns['trail_rates'] = {int(k): v for k, v in self.columns['trail_rates'].items()}
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.keys = pd.MultiIndex.from_arrays([
+            np.asarray(self.keys_cons, dtype=object),
+            np.asarray(self.keys_scheme, dtype=object),
+        ])
+
+    @property
+    def is_complete(self):
+        """True when Cons Code and Scheme Code were found, i.e. the index can match anything"""
+        return bool(self.columns['cons_code'] and self.columns['scheme_code'])
+
+    @classmethod
+    def compile(cls, combined_brokerage_df):
+        """Normalize the combined Brokerage Structure and build the interval index"""
+        columns = detect_brokerage_columns(combined_brokerage_df.columns)
+        cons_code_col = columns['cons_code']
+        scheme_code_b_col = columns['scheme_code']
+        investment_period_from_col = columns['period_from']
+        investment_period_to_col = columns['period_to']
+
+        if cons_code_col and scheme_code_b_col:
+            # Normalize Brokerage Structure for matching
+            brokerage_normalized = combined_brokerage_df.copy()
+            brokerage_normalized[cons_code_col] = brokerage_normalized[cons_code_col].astype(str).str.strip().str.upper()
+            brokerage_normalized[scheme_code_b_col] = brokerage_normalized[scheme_code_b_col].astype(str).str.strip().str.upper()
+
+            # Remove NaN values that might cause issues
+            brokerage_normalized = brokerage_normalized[
+                (brokerage_normalized[cons_code_col] != 'NAN') &
+                (brokerage_normalized[cons_code_col] != '') &
+                (brokerage_normalized[scheme_code_b_col] != 'NAN') &
+                (brokerage_normalized[scheme_code_b_col] != '')
+            ].reset_index(drop=True)
+            cons = brokerage_normalized[cons_code_col].to_numpy(dtype=object)
+            schemes = brokerage_normalized[scheme_code_b_col].to_numpy(dtype=object)
+        else:
+            brokerage_normalized = combined_brokerage_df.iloc[0:0]
+            cons = schemes = np.array([], dtype=object)
+
+        row_keys, keys = pd.factorize(pd.MultiIndex.from_arrays([cons, schemes]))
+        n_keys = len(keys)
+
+        # Convert Investment Period dates to datetime if columns exist
+        if investment_period_from_col:
+            period_from = pd.to_datetime(brokerage_normalized[investment_period_from_col], errors='coerce', dayfirst=True)
+        else:
+            period_from = pd.Series(pd.NaT, index=brokerage_normalized.index)
+        if investment_period_to_col:
+            period_to = pd.to_datetime(brokerage_normalized[investment_period_to_col], errors='coerce', dayfirst=True)
+        else:
+            period_to = pd.Series(pd.NaT, index=brokerage_normalized.index)
+
+        # Fallback row per key (used when there is no date filter): the first row of the group
+        _, key_first_row = np.unique(row_keys, return_index=True)
+
+        # Only rows with both period dates take part in date filtering
+        pf, pf_valid = _datetime_to_us(period_from)
+        pt, pt_valid = _datetime_to_us(period_to)
+        has_period = pf_valid & pt_valid
+        key_has_period = np.bincount(row_keys[has_period], minlength=n_keys) > 0
+
+        # Elementary segment starts: every period start and the instant after every period end
+        p_rows = np.flatnonzero(has_period)
+        seg = pd.DataFrame({
+            'key': np.concatenate([row_keys[p_rows], row_keys[p_rows]]),
+            't': np.concatenate([pf[p_rows], pt[p_rows] + 1]),
+        }).drop_duplicates().sort_values(['key', 't'], ignore_index=True)
+
+        # First covering row for each segment (periods per key are few, so the per-key cross join is small)
+        periods = pd.DataFrame({'key': row_keys[p_rows], 'row': p_rows, 'pf': pf[p_rows], 'pt': pt[p_rows]})
+        cover = seg.merge(periods, on='key')
+        cover = cover[(cover['pf'] <= cover['t']) & (cover['t'] <= cover['pt'])]
+        first_cover = cover.groupby(['key', 't'], as_index=False)['row'].min()
+        seg = seg.merge(first_cover, on=['key', 't'], how='left')
+
+        seg_times = np.unique(seg['t'].to_numpy(dtype=np.int64))
+        seg_key = seg['key'].to_numpy(dtype=np.int64)
+        # Rank of each segment start among all segment starts (1-based), packed with the key
+        seg_rank = np.searchsorted(seg_times, seg['t'].to_numpy(dtype=np.int64), side='right')
+
+        arrays = {
+            'keys_cons': np.asarray([str(k[0]) for k in keys], dtype=str),
+            'keys_scheme': np.asarray([str(k[1]) for k in keys], dtype=str),
+            'key_first_row': np.asarray(key_first_row, dtype=np.int64),
+            'key_has_period': key_has_period,
+            'seg_times': seg_times,
+            'seg_key': seg_key,
+            'seg_row': seg['row'].fillna(-1).to_numpy(dtype=np.int64),
+            'seg_composite': seg_key * (len(seg_times) + 1) + seg_rank,
+        }
+
+        # Output values per brokerage row: the cell text ('' for blanks) plus a typed array, float64
+        # rates and, for periods, datetime64 only where the cell already held a date (Excel date
+        # cells). Periods are written back as given; the parsed dates above are for matching only.
+        value_sources = {f'trail_rate_{year}': col for year, col in columns['trail_rates'].items()}
+        value_sources['period_from'] = investment_period_from_col
+        value_sources['period_to'] = investment_period_to_col
+        values = {}
+        for role, col in value_sources.items():
+            if not col:
+                continue
+            raw = brokerage_normalized[col]
+            text = raw.where(raw.notna(), '').astype(str)
+            arrays[f'{role}_text'] = np.asarray(text.where(text.str.strip() != '', '').tolist(), dtype=str)
+            if role in ('period_from', 'period_to'):
+                parsed = period_from if role == 'period_from' else period_to
+                if pd.api.types.is_datetime64_any_dtype(raw.dtype):
+                    native = raw.notna().to_numpy()
+                else:
+                    native = np.fromiter((isinstance(v, datetime) for v in raw), dtype=bool, count=len(raw))
+                arrays[f'{role}_typed'] = parsed.where(native).dt.as_unit('us').to_numpy()
+            else:
+                arrays[f'{role}_typed'] = parse_trail_rate(raw)
+            values[role] = col
+
+        meta = {
+            'version': BROKERAGE_INDEX_VERSION,
+            'columns': columns,
+            'values': values,
+            'brokerage_rows': len(combined_brokerage_df),
+            'indexed_rows': len(brokerage_normalized),
+            'keys': n_keys,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        return cls(arrays, meta)
+
+    def save(self, content_key):
+        """Write the index under BROKERAGE_INDEX_DIR/<content_key>, replacing atomically"""
+        target = os.path.join(BROKERAGE_INDEX_DIR, content_key)
+        tmp = f'{target}.tmp{os.getpid()}'
+        os.makedirs(tmp, exist_ok=True)
+        for name, arr in self.arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), arr, allow_pickle=False)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2, default=str)
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+
+        # Keep only the most recent compiled indexes
+        # (another process's <key>.tmp<pid> directory is still being written, so it is never a candidate)
+        entries = [os.path.join(BROKERAGE_INDEX_DIR, d) for d in os.listdir(BROKERAGE_INDEX_DIR) if '.tmp' not in d]
+        entries = sorted((e for e in entries if os.path.isdir(e)), key=os.path.getmtime, reverse=True)
+        for stale in entries[BROKERAGE_INDEX_KEEP:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    @classmethod
+    def load(cls, content_key):
+        """Memory-map a previously compiled index, or return None when there is none for this content"""
+        target = os.path.join(BROKERAGE_INDEX_DIR, content_key)
+        meta_path = os.path.join(target, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != BROKERAGE_INDEX_VERSION:
+                return None
+            arrays = {}
+            for name in os.listdir(target):
+                if name.endswith('.npy'):
+                    arrays[name[:-4]] = np.load(os.path.join(target, name), mmap_mode='r', allow_pickle=False)
+            os.utime(target)  # mark as recently used
+            return cls(arrays, meta)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def key_codes(self, brokers, subfunds):
+        """Map broker / subfund Series to key codes (-1 where the pair is missing or unknown)"""
+        # Normalized once per distinct code; the categoricals become the MultiIndex levels directly
+        broker_str = map_distinct(brokers, lambda u: u.astype(str).str.strip().str.upper())
+        subfund_str = map_distinct(subfunds, lambda u: u.astype(str).str.strip().str.upper())
+        codes = self.keys.get_indexer(pd.MultiIndex.from_arrays([broker_str, subfund_str]))
+        missing = (
+            mask_distinct(brokers, lambda u: u.isna() | u.astype(str).eq('')) |
+            mask_distinct(subfunds, lambda u: u.isna() | u.astype(str).isin(['Not Found', '']))
+        )
+        codes[missing] = -1
+        return codes
+
+    def _segment_rows(self, codes, t):
+        """Vectorized interval stab: first covering brokerage row for each (code, t)"""
+        r = np.searchsorted(self.seg_times, t, side='right')
+        composite = codes * (len(self.seg_times) + 1) + r
+        pos = np.searchsorted(self.seg_composite, composite, side='right') - 1
+        pos_safe = np.clip(pos, 0, None)
+        hit = (pos >= 0) & (self.seg_key[pos_safe] == codes) if len(self.seg_key) else np.zeros(len(codes), dtype=bool)
+        rows = np.full(len(codes), -1, dtype=np.int64)
+        rows[hit] = self.seg_row[pos_safe[hit]]
+        return rows
+
+    def lookup(self, codes, tran_dates):
+        """Resolve brokerage rows for the transaction date and the first day of the previous month.
+
+        Returns (current_rows, previous_rows) as positional arrays, -1 meaning 'Not Found'.
+        The previous-month match is only made when it falls in the same calendar year.
+        """
+        return self.lookup_legs([codes], tran_dates)[0]
+
+    def lookup_legs(self, leg_codes, tran_dates):
+        """Resolve several legs (e.g. switch IN and OUT) sharing the same transaction dates in one pass.
+
+        The date arithmetic is done once and all legs go through a single stacked
+        searchsorted; returns one (current_rows, previous_rows) pair per leg.
+        """
+        n = len(tran_dates)
+        n_legs = len(leg_codes)
+        codes = np.concatenate([np.asarray(c, dtype=np.int64) for c in leg_codes]) if n_legs else np.array([], dtype=np.int64)
+        current_rows = np.full(len(codes), -1, dtype=np.int64)
+        previous_rows = np.full(len(codes), -1, dtype=np.int64)
+        known = codes >= 0
+
+        if known.any():
+            tran_dates = pd.to_datetime(pd.Series(tran_dates), errors='coerce').reset_index(drop=True)
+            t_cur, t_valid = _datetime_to_us(tran_dates)
+            # First day of the previous month, keeping the time of day (same as replace(day=1) - 1 day)
+            month_start = tran_dates - pd.to_timedelta(tran_dates.dt.day - 1, unit='D')
+            previous_month = month_start - pd.to_timedelta((month_start - pd.Timedelta(days=1)).dt.day, unit='D')
+            t_prev, _ = _datetime_to_us(previous_month)
+            same_year = (tran_dates.dt.month != 1).to_numpy()
+            t_cur, t_valid, t_prev, same_year = (np.tile(a, n_legs) for a in (t_cur, t_valid, t_prev, same_year))
+
+            safe_codes = np.where(known, codes, 0)
+            dated = known & t_valid & self.key_has_period[safe_codes]
+            undated = known & ~dated
+
+            # No usable date filter: first row of the group for the current month only
+            current_rows[undated] = self.key_first_row[codes[undated]]
+            if dated.any():
+                # Current and previous month stabs share one searchsorted as well
+                prev_mask = dated & same_year
+                stab_codes = np.concatenate([codes[dated], codes[prev_mask]])
+                stab_times = np.concatenate([t_cur[dated], t_prev[prev_mask]])
+                stab_rows = self._segment_rows(stab_codes, stab_times)
+                n_dated = int(dated.sum())
+                current_rows[dated] = stab_rows[:n_dated]
+                previous_rows[prev_mask] = stab_rows[n_dated:]
+
+        return [(current_rows[i * n:(i + 1) * n], previous_rows[i * n:(i + 1) * n]) for i in range(n_legs)]
+
+    def take(self, role, rows):
+        """Gather output values ('trail_rate_1', 'period_from', ...) for positional rows.
+
+        Rates are returned parsed where they parse, periods as the brokerage cell held them
+        (text, or the date of an Excel date cell); the original text otherwise, and
+        'Not Found' for blanks or rows == -1.
+        """
+        out = np.full(len(rows), 'Not Found', dtype=object)
+        if role not in self.meta['values']:
+            return out
+        found = rows >= 0
+        r = rows[found]
+        vals = np.asarray(self.arrays[f'{role}_text'][r], dtype=object)
+        vals[vals == ''] = 'Not Found'
+        typed = np.asarray(self.arrays[f'{role}_typed'][r])
+        if typed.dtype.kind == 'M':
+            ok = ~np.isnat(typed)
+            vals[ok] = pd.to_datetime(typed[ok]).astype(object)
+        else:
+            ok = ~np.isnan(typed)
+            vals[ok] = typed[ok].astype(object)
+        out[found] = vals
+        return out
+
+    def take_rate(self, role, rows):
+        """Gather a trail rate as float64 for positional rows, NaN where missing or not numeric"""
+        out = np.full(len(rows), np.nan, dtype=np.float64)
+        if role not in self.meta['values']:
+            return out
+        found = rows >= 0
+        out[found] = self.arrays[f'{role}_typed'][rows[found]]
+        return out
+
+    def rate_status(self, role, rows):
+        """Categorical status for a gathered rate: Found, Rate Missing (row matched, rate blank) or Not Found"""
+        status = np.full(len(rows), 'Not Found', dtype=object)
+        status[rows >= 0] = 'Rate Missing'
+        status[~np.isnan(self.take_rate(role, rows))] = 'Found'
+        return pd.Categorical(status, categories=RATE_STATUS_CATEGORIES)
+
+
+# Unique (switch in, switch out) scheme pairs remembered across runs
+REGULAR_DIRECT_CACHE_SIZE = 100000
+
+
+def remove_code_prefix(scheme_str):
+    """Remove code prefix (e.g. "129B/ABSL" or any code before "/")"""
+    if '/' in scheme_str:
+        # Split by "/" and take everything after the first "/"
+        return scheme_str.split('/', 1)[1].strip()
+    return scheme_str
+
+
+def normalize_for_match(scheme):
+    """Remove Regular, Direct, Reg, Growth, Plan so "Regular" vs "Direct" don't hurt similarity"""
+    s = scheme.upper()
+    for word in ['REGULAR GROWTH', 'REG GROWTH', 'REGULAR', 'REG PLAN', 'DIRECT GROWTH', 'DIRECT', 'REG', 'GROWTH', 'PLAN']:
+        s = s.replace(word, '')
+    s = s.replace('-', ' ').replace('_', ' ').strip()
+    while '  ' in s:
+        s = s.replace('  ', ' ')
+    return s.strip()
+
+
+@functools.lru_cache(maxsize=REGULAR_DIRECT_CACHE_SIZE)
+def regular_direct_check(switch_in_upper, switch_out_upper):
+    """'Check' if the two (stripped, uppercased) schemes are the same scheme but one is Regular and the other Direct"""
+    if switch_in_upper == '' or switch_out_upper == '':
+        return ''
+    scheme_in = remove_code_prefix(switch_in_upper)
+    scheme_out = remove_code_prefix(switch_out_upper)
+    if not scheme_in or not scheme_out:
+        return ''
+
+    norm_in = normalize_for_match(scheme_in)
+    norm_out = normalize_for_match(scheme_out)
+    if not norm_in or not norm_out:
+        return ''
+    # Exact match or fuzzy 75% on normalized base names
+    if norm_in != norm_out:
+        similarity = difflib.SequenceMatcher(None, norm_in, norm_out).ratio()
+        if similarity < 0.75:
+            return ''
+
+    # Regular: REGULAR, REG GROWTH, REG PLAN, REG (with word boundary)
+    has_regular_in = 'REGULAR' in switch_in_upper or 'REG GROWTH' in switch_in_upper or 'REG PLAN' in switch_in_upper or '-REG-' in switch_in_upper or ' REG ' in switch_in_upper
+    has_regular_out = 'REGULAR' in switch_out_upper or 'REG GROWTH' in switch_out_upper or 'REG PLAN' in switch_out_upper or '-REG-' in switch_out_upper or ' REG ' in switch_out_upper
+    # Direct
+    has_direct_in = 'DIRECT' in switch_in_upper
+    has_direct_out = 'DIRECT' in switch_out_upper
+    # One Regular + one Direct = Check (e.g. -PLAN-Regular-Growth vs -PLAN-Direct-Growth)
+    if (has_regular_in and has_direct_out) or (has_direct_in and has_regular_out):
+        return 'Check'
+    return ''
+
+
+def regular_direct_checks(switch_in, switch_out):
+    """Regular vs Direct check for whole columns, evaluated once per distinct scheme pair"""
+    in_upper = switch_in.astype(str).str.strip().str.upper().where(switch_in.notna(), '')
+    out_upper = switch_out.astype(str).str.strip().str.upper().where(switch_out.notna(), '')
+    in_codes, in_uniques = pd.factorize(in_upper)
+    out_codes, out_uniques = pd.factorize(out_upper)
+    pair_codes, pair_inverse = np.unique(in_codes.astype(np.int64) * max(len(out_uniques), 1) + out_codes, return_inverse=True)
+    pair_results = np.array([
+        regular_direct_check(in_uniques[code // max(len(out_uniques), 1)], out_uniques[code % max(len(out_uniques), 1)])
+        for code in pair_codes
+    ], dtype=object)
+    return pair_results[pair_inverse.reshape(-1)] if len(pair_codes) else np.array([], dtype=object)
+
+
+def detect_rta_columns(columns):
+    """Find Scheme_code, PARENT_SUB_FUND_CODE, ASSET_CLASS and the plan / option / scheme name columns in RTA Master"""
+    found = {
+        'scheme_code': None,
+        'parent_sub_fund_code': None,
+        'asset_class': None,
+        'plan': None,
+        'option': None,
+        'scheme_name': None,
+    }
+    for col in columns:
+        try:
+            col_upper = str(col).upper().strip()
+            if col_upper == 'SCHEME_CODE' or col_upper == 'SCHEME CODE':
+                found['scheme_code'] = col
+            elif col_upper == 'PARENT_SUB_FUND_CODE' or col_upper == 'PARENT SUB FUND CODE':
+                found['parent_sub_fund_code'] = col
+            elif col_upper == 'ASSET_CLASS' or col_upper == 'ASSET CLASS' or ('ASSET' in col_upper and 'CLASS' in col_upper):
+                found['asset_class'] = col
+            elif col_upper in ('PLAN', 'PLAN_TYPE', 'PLAN TYPE', 'PLANDESC', 'PLAN_DESC', 'PLAN_NAME', 'PLAN NAME'):
+                found['plan'] = col
+            elif col_upper in ('OPTION', 'OPTDESC', 'OPTION_DESC', 'OPTION_TYPE', 'OPTION TYPE', 'OPTION_NAME', 'OPTION NAME'):
+                found['option'] = col
+            elif col_upper in ('SCHEME_NAME', 'SCHEME NAME', 'SCHEMEDESC', 'SCHEME_DESC', 'SCHEME DESCRIPTION', 'SCHEME_DESCRIPTION'):
+                found['scheme_name'] = col
+        except (TypeError, AttributeError):
+            # Skip columns that can't be converted to string or checked
+            continue
+    return found
+
+
+def classify_plan_type(values):
+    """Classify plan / scheme text as 'Regular', 'Direct' or '' (unknown or both), same tokens as regular_direct_check"""
+    text = ' ' + values.astype(str).str.strip().str.upper().where(values.notna(), '') + ' '
+    is_direct = text.str.contains('DIRECT', regex=False)
+    is_regular = (
+        text.str.contains('REGULAR', regex=False) | text.str.contains('REG GROWTH', regex=False) |
+        text.str.contains('REG PLAN', regex=False) | text.str.contains('-REG-', regex=False) |
+        text.str.contains(' REG ', regex=False)
+    )
+    return np.select([is_direct & ~is_regular, is_regular & ~is_direct], ['Direct', 'Regular'], '').astype(object)
+
+
+class SchemeFamilyIndex:
+    """Scheme code -> (family id, plan type, option) built from the RTA Master.
+
+    Schemes sharing a PARENT_SUB_FUND_CODE are one family; plan type comes from the
+    plan column, or the scheme name when there is none, and option ('' when unknown)
+    from the option column. A Regular vs Direct check is then two get_indexer lookups
+    and an array comparison per run.
+    """
+
+    def __init__(self, codes, family, plan, option):
+        self.codes = pd.Index(codes)
+        self.family = family
+        self.plan = plan
+        self.option = option
+
+    @classmethod
+    def from_rta(cls, rta_df, rta_columns):
+        """Build the index, or None when the RTA Master lacks the code / family / plan information"""
+        scheme_code_col = rta_columns['scheme_code']
+        parent_sub_fund_code_col = rta_columns['parent_sub_fund_code']
+        plan_source_col = rta_columns['plan'] or rta_columns['scheme_name']
+        if not (scheme_code_col and parent_sub_fund_code_col and plan_source_col):
+            return None
+
+        option = ''
+        if rta_columns['option']:
+            option_values = rta_df[rta_columns['option']]
+            option = option_values.astype(str).str.strip().str.upper().where(option_values.notna(), '')
+        frame = pd.DataFrame({
+            'code': rta_df[scheme_code_col].astype(str).str.strip().str.upper(),
+            'family': rta_df[parent_sub_fund_code_col].astype(str).str.strip().str.upper(),
+            'plan': classify_plan_type(rta_df[plan_source_col]),
+            'option': option,
+        })
+        frame = frame[~frame['code'].isin(['', 'NAN']) & ~frame['family'].isin(['', 'NAN'])]
+        # Last row wins for repeated codes, like the Scheme_code -> PARENT_SUB_FUND_CODE mapping
+        frame = frame.drop_duplicates('code', keep='last')
+        family_ids, _ = pd.factorize(frame['family'])
+        return cls(
+            frame['code'].to_numpy(dtype=object),
+            family_ids.astype(np.int64),
+            frame['plan'].to_numpy(dtype=object),
+            frame['option'].to_numpy(dtype=object),
+        )
+
+    def checks(self, in_codes, out_codes):
+        """Regular vs Direct per row from scheme codes.
+
+        Returns (result, resolved): result is 'Check' / '' and resolved marks rows whose
+        codes are both indexed with a known plan type; other rows need the name-based check.
+        Only a plan switch within one family and one option is flagged (an unknown option
+        matches any), so Regular Growth -> Direct IDCW is not a Regular vs Direct switch.
+        """
+        pos_in = self.codes.get_indexer(in_codes.astype(str).str.strip().str.upper())
+        pos_out = self.codes.get_indexer(out_codes.astype(str).str.strip().str.upper())
+        resolved = (pos_in >= 0) & (pos_out >= 0)
+        safe_in = np.where(resolved, pos_in, 0)
+        safe_out = np.where(resolved, pos_out, 0)
+        plan_in = self.plan[safe_in] if len(self.plan) else np.full(len(pos_in), '', dtype=object)
+        plan_out = self.plan[safe_out] if len(self.plan) else np.full(len(pos_out), '', dtype=object)
+        resolved &= (plan_in != '') & (plan_out != '')
+        same_family = self.family[safe_in] == self.family[safe_out] if len(self.family) else np.zeros(len(pos_in), dtype=bool)
+        if len(self.option):
+            option_in, option_out = self.option[safe_in], self.option[safe_out]
+            same_option = (option_in == option_out) | (option_in == '') | (option_out == '')
+        else:
+            same_option = np.ones(len(pos_in), dtype=bool)
+        result = np.where(resolved & same_family & same_option & (plan_in != plan_out), 'Check', '').astype(object)
+        return result, resolved
+
+
+def cached_read(path, reader, **options):
+    """reader(path, **options) through the parsed-input cache in INPUT_CACHE_DIR (see input_cache.cached_read)"""
+    return input_cache.cached_read(INPUT_CACHE_DIR, INPUT_CACHE_MAX_BYTES, path, reader, **options)
+
+
+def excel_engine(path):
+    """Fastest installed pd.read_excel engine for a workbook: calamine (Rust) for every format it reads,
+    otherwise None, i.e. pandas' default for the extension (openpyxl, xlrd for .xls, pyxlsb for .xlsb)"""
+    if not path.lower().endswith(CALAMINE_EXTENSIONS):
+        return None
+    return 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+
+def excel_header_engine(path):
+    """Engine for reading only the header row: openpyxl streams .xlsx rows, whereas calamine parses the
+    whole sheet first, so it only wins for the other formats"""
+    if path.lower().endswith(('.xlsx', '.xlsm')) and importlib.util.find_spec('openpyxl'):
+        return 'openpyxl'
+    return excel_engine(path)
+
+
+def read_excel(path, **options):
+    """pd.read_excel with excel_engine(path) unless options name the engine, reporting the engine used"""
+    if 'engine' not in options:
+        options['engine'] = excel_engine(path)
+    print(f"\n=== Reading {os.path.basename(path)} with the {options['engine'] or 'default'} Excel engine ===")
+    return pd.read_excel(path, **options)
+
+
+def csv_float_columns(columns):
+    """Units and amount columns (SO_UNITS, SI_AMOUNT, ...), read as float64; every other CSV column is text"""
+    return [col for col in columns if 'UNITS' in _norm(col) or 'AMOUNT' in _norm(col)]
+
+
+def _csv_arrow_options(path, usecols):
+    """pyarrow.csv options matching pd.read_csv on this file: pandas' own header names (blank and
+    duplicate headers become 'Unnamed: 3' / 'X.1' alike), its NA strings, and every column as text"""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    names = [str(col) for col in pd.read_csv(path, nrows=0).columns]
+    wanted = set(usecols) if usecols else None
+    include = [col for col in names if wanted is None or col in wanted]
+    read_options = pacsv.ReadOptions(column_names=names, skip_rows=1, use_threads=True)
+    convert_options = pacsv.ConvertOptions(column_types={col: pa.string() for col in include},
+                                           include_columns=include, null_values=CSV_NULL_VALUES,
+                                           strings_can_be_null=True)
+    return read_options, convert_options
+
+
+def _csv_source(path):
+    """Memory map for files of CSV_MEMORY_MAP_BYTES or more (the parser reads pages straight from the
+    OS cache instead of copying the file through read buffers), the path otherwise"""
+    import pyarrow as pa
+    return pa.memory_map(path) if os.path.getsize(path) >= CSV_MEMORY_MAP_BYTES else path
+
+
+def _csv_table_to_frame(table):
+    """DataFrame from an all-text Arrow table, with units / amounts cast to float64.
+
+    The cast is correctly rounded, so floats write back as the register's own digits. A column
+    holding non-numbers ('1,000', 'N.A.') stays text, as pd.read_csv would leave it.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    for col in csv_float_columns(table.column_names):
+        i = table.column_names.index(col)
+        try:
+            table = table.set_column(i, col, pc.cast(table.column(i), pa.float64()))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return table.to_pandas()
+
+
+def read_csv_arrow(path, usecols=None):
+    """Read a CSV input with pyarrow's multithreaded parser (pd.read_csv without pyarrow, or for files
+    Arrow rejects, e.g. short rows pandas pads with blanks).
+
+    Codes, names and dates stay text (no per-value type guessing, leading zeros kept, dates written
+    back as given and parsed dayfirst by the pipeline); units and amounts are float64.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        return pd.read_csv(path, usecols=usecols)
+    try:
+        read_options, convert_options = _csv_arrow_options(path, usecols)
+        source = _csv_source(path)
+        try:
+            table = pacsv.read_csv(source, read_options=read_options, convert_options=convert_options)
+        finally:
+            if not isinstance(source, str):
+                source.close()
+    except pa.ArrowInvalid as e:
+        print(f"\n=== Arrow could not parse {os.path.basename(path)} ({e}): reading it with pandas ===")
+        return pd.read_csv(path, usecols=usecols)
+    return _csv_table_to_frame(table)
+
+
+def read_csv_blocks(path, rows, usecols=None, engine='arrow'):
+    """Yield a CSV input as DataFrames of `rows` rows, typed like read_csv_arrow, from pyarrow's
+    streaming reader (pd.read_csv chunks with engine='pandas' or without pyarrow).
+
+    The file is read as a plain stream, not memory-mapped: a map keeps every page it has passed
+    resident, so a multi-GB register would end up fully mapped. Arrow's default 1 MB parse blocks
+    keep its readahead small. A row Arrow rejects raises pyarrow.ArrowInvalid (a ValueError)
+    part-way through.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        engine = 'pandas'
+    if engine == 'pandas':
+        yield from pd.read_csv(path, chunksize=rows, usecols=usecols)
+        return
+    read_options, convert_options = _csv_arrow_options(path, usecols)
+    reader = pacsv.open_csv(path, read_options=read_options, convert_options=convert_options)
+    pending = None
+    for batch in reader:
+        batch_table = pa.Table.from_batches([batch])
+        pending = batch_table if pending is None else pa.concat_tables([pending, batch_table])
+        while pending.num_rows >= rows:
+            yield _csv_table_to_frame(pending.slice(0, rows))
+            pending = pending.slice(rows)
+    if pending is not None and pending.num_rows:
+        yield _csv_table_to_frame(pending)
+
+
+def read_input_header(path):
+    """Read only the header row of a CSV / Excel input, returning (columns, duplicate column names)"""
+    if path.endswith('.csv'):
+        columns = pd.read_csv(path, nrows=0).columns
+    else:
+        columns = pd.read_excel(path, nrows=0, engine=excel_header_engine(path)).columns
+    dupes = columns[columns.duplicated()].tolist() if columns.duplicated().any() else []
+    return columns, dupes
+
+
+def read_input_file(path, usecols=None):
+    """Read one CSV / Excel input, only the usecols columns when given (worker process entry point)"""
+    # An empty projection means none of the known aliases matched: read everything and let validation report it
+    options = {'usecols': list(usecols)} if usecols else {}
+    if path.endswith('.csv'):
+        return cached_read(path, read_csv_arrow, **options)
+    # The engine is resolved here so it is part of the cache key: calamine and openpyxl can parse
+    # dates, integers and blank cells differently, so one engine's frame is never served for the other
+    return cached_read(path, read_excel, engine=excel_engine(path), **options)
+
+
+def read_input_files(paths, usecols=None, max_workers=None):
+    """Parse several inputs concurrently in a process pool, returning DataFrames in the order given.
+
+    Excel parsing holds the GIL (openpyxl is pure Python, calamine builds Python objects per
+    cell), so threads would not help; each worker returns its DataFrame pickled (numpy
+    blocks travel as single buffers, no per-cell copy).
+    usecols, when given, holds one column list (or None) per path.
+    """
+    usecols = usecols or [None] * len(paths)
+    if len(paths) <= 1:
+        return [read_input_file(path, cols) for path, cols in zip(paths, usecols)]
+    max_workers = max_workers or min(len(paths), os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(read_input_file, paths, usecols))
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None where the platform does not report it)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KB on Linux, bytes on macOS
+        return round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 ** 2, 1)  # peak working set on Windows
+    except ImportError:
+        return None
+
+
+class RunStats:
+    """Wall time, CPU time, peak RSS, row and match counts per pipeline stage.
+
+    Stages recorded under the same name accumulate, so a streamed run reports one line
+    per stage. CPU time is this process only (ingestion workers are not included).
+    """
+
+    COLUMNS = ['stage', 'calls', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'matched', 'unmatched']
+
+    def __init__(self):
+        self.stages = {}
+
+    def start(self, name, rows_in=None):
+        """Begin timing a stage; pass the returned token to stop()"""
+        return name, time.perf_counter(), time.process_time(), rows_in
+
+    def stop(self, token, rows_out=None, matched=None, unmatched=None):
+        """Finish a stage and add its figures to the totals recorded under its name"""
+        name, wall_start, cpu_start, rows_in = token
+        record = self.stages.setdefault(name, dict.fromkeys(self.COLUMNS))
+        record['stage'] = name
+        record['calls'] = (record['calls'] or 0) + 1
+        record['wall_s'] = (record['wall_s'] or 0.0) + time.perf_counter() - wall_start
+        record['cpu_s'] = (record['cpu_s'] or 0.0) + time.process_time() - cpu_start
+        record['peak_rss_mb'] = peak_rss_mb()
+        for key, value in (('rows_in', rows_in), ('rows_out', rows_out), ('matched', matched), ('unmatched', unmatched)):
+            if value is not None:
+                record[key] = (record[key] or 0) + int(value)
+
+    def to_frame(self):
+        """Stage table as a DataFrame (one row per stage, in first-seen order)"""
+        df = pd.DataFrame(list(self.stages.values()), columns=self.COLUMNS)
+        df[['wall_s', 'cpu_s']] = df[['wall_s', 'cpu_s']].astype(float).round(3)
+        counts = ['calls', 'rows_in', 'rows_out', 'matched', 'unmatched']
+        df[counts] = df[counts].astype('Int64')
+        return df
+
+    def to_json(self, path):
+        """Write the stage table to a JSON file"""
+        payload = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'stages': json.loads(self.to_frame().to_json(orient='records')),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+
+    def report(self):
+        """Print the stage table"""
+        print("\n=== Run Stats ===")
+        print(self.to_frame().to_string(index=False))
+
+
+def run_stats_path(save_path):
+    """Run stats JSON written next to the output file"""
+    return os.path.splitext(save_path)[0] + '_run_stats.json'
+
+
+# Output only these columns, in this exact order (Trail Rate 2-5 year columns are appended when present)
+OUTPUT_COLUMNS = [
+    'SL_NO', 'FOLIO_NO', 'INVESTOR_F', 'USER_TRXNN', 'OUT_TRXN_N',
+    'SO_ASSET_C', 'OUT_SUBFUN', 'OUT_SCHEME', 'OUT_SCHEM0', 'OUT_TRADE_',
+    'OUT_BROKER', 'OUT_BROKE1', 'SO_UNITS', 'SO_AMOUNT',
+    'IN_SUBFUND', 'IN_SCHEME', 'IN_SCHEME_', 'SI_ASSET_C', 'IN_TRADE_D',
+    'IN_BROKER', 'SI_UNITS', 'SI_AMOUNT',
+    'IN ASSET_CLASS', 'out ASSET_CLASS',
+    'Investment Period From', 'Investment Period To',
+    'switch in Trail Rate 1 year', 'PREVIOUS switch in Trail Rate 1 year',
+    'PREVIOUS switch in Trail Rate 1 year Check',
+    'switch out Trail Rate 1 year', 'PREVIOUS switch out Trail Rate 1 year',
+    'Check 1 year', 'Regular vs Direct Check',
+    # Why a year-1 rate is 'Not Found': Found / Rate Missing (brokerage row matched, rate blank) / Not Found
+    'switch in Trail Rate Status', 'switch out Trail Rate Status'
+]
+# Streaming mode: CSV Switch Registers at least this large are processed in blocks of rows
+STREAMING_THRESHOLD_BYTES = 512 * 1024 ** 2
+STREAMING_CHUNK_ROWS = 250000
+
+
+def _norm(s):
+    """Uppercase, strip and collapse spaces so "OUT SUBFUN" / "OUT_SUBFUN" both match"""
+    try:
+        t = str(s).upper().lstrip('\ufeff').strip()
+        return ' '.join(t.split()).replace(' ', '_')
+    except (TypeError, AttributeError):
+        return ''
+
+
+def detect_switch_columns(columns):
+    """Detect IN/OUT broker, subfund and asset columns in a Switch Register header (no RTA needed when all four codes exist)"""
+    found = {'in_broker': None, 'in_subfund': None, 'out_broker': None, 'out_subfund': None,
+             'so_asset': None, 'si_asset': None}
+    for col in columns:
+        try:
+            c = _norm(col)
+            c_spaces = c.replace('_', ' ')
+            if c in ('IN_BROKER',) or c_spaces == 'IN BROKER':
+                found['in_broker'] = col
+            elif c in ('IN_SUBFUND', 'IN_SUBFUN',) or c_spaces in ('IN SUBFUND', 'IN SUBFUN'):
+                found['in_subfund'] = col
+            elif c in ('OUT_BROKER',) or c_spaces == 'OUT BROKER':
+                found['out_broker'] = col
+            elif c in ('OUT_SUBFUND', 'OUT_SUBFUN',) or c_spaces in ('OUT SUBFUND', 'OUT SUBFUN'):
+                found['out_subfund'] = col
+            elif c in ('SO_ASSET_C',) or c_spaces == 'SO ASSET C':
+                found['so_asset'] = col
+            elif c in ('SI_ASSET_C', 'IN_ASSET_C',) or c_spaces in ('SI ASSET C', 'IN ASSET C'):
+                found['si_asset'] = col
+        except (TypeError, AttributeError):
+            continue
+    found['use_switch_columns'] = bool(found['in_broker'] and found['in_subfund'] and found['out_broker'] and found['out_subfund'])
+    return found
+
+
+def switch_register_usecols(columns):
+    """Switch Register columns the pipeline can touch: OUTPUT_COLUMNS plus every broker, subfund, asset,
+    scheme and date alias. A superset of what the detection loops match, so they pick the same columns."""
+    usecols = []
+    for col in columns:
+        col_upper = str(col).upper().strip()
+        if (str(col) in OUTPUT_COLUMNS or col_upper == 'FROM' or 'SCHEM' in col_upper or 'BROK' in col_upper
+                or 'DATE' in col_upper or 'TRADE' in col_upper
+                or any(found for key, found in detect_switch_columns([col]).items() if key != 'use_switch_columns')):
+            usecols.append(col)
+    return usecols
+
+
+def rta_master_usecols(columns):
+    """RTA Master columns matching any detect_rta_columns alias"""
+    return [col for col in columns if any(detect_rta_columns([col]).values())]
+
+
+def brokerage_usecols(columns):
+    """Brokerage Structure columns matching any detect_brokerage_columns alias"""
+    return [col for col in columns if any(detect_brokerage_columns([col]).values())]
+
+
+class SwitchReferences:
+    """Reference data shared by every block of Switch Register rows.
+
+    Built once per run: the brokerage index, the Scheme_code -> PARENT_SUB_FUND_CODE /
+    ASSET_CLASS maps and the scheme-family index, so streamed blocks never rebuild them.
+    """
+
+    def __init__(self, brokerage_index=None, rta_df=None):
+        self.brokerage_index = brokerage_index
+        self.rta_columns = None
+        self.scheme_family_index = None
+        self.subfund_mapping = None
+        self.asset_class_mapping = {}
+        if rta_df is None:
+            return
+        self.rta_columns = detect_rta_columns(rta_df.columns)
+        self.scheme_family_index = SchemeFamilyIndex.from_rta(rta_df, self.rta_columns)
+        scheme_code_col = self.rta_columns['scheme_code']
+        parent_sub_fund_code_col = self.rta_columns['parent_sub_fund_code']
+        asset_class_col = self.rta_columns['asset_class']
+        if scheme_code_col and parent_sub_fund_code_col:
+            # Normalized codes; a repeated Scheme_code keeps its last row
+            scheme_codes = rta_df[scheme_code_col].astype(str).str.strip()
+            self.subfund_mapping = dict(zip(scheme_codes, rta_df[parent_sub_fund_code_col].astype(str).str.strip()))
+            if asset_class_col:
+                self.asset_class_mapping = dict(zip(scheme_codes, rta_df[asset_class_col].astype(str).str.strip()))
+
+
+def process_switch_rows(switch_df, refs, switch_columns, notices, status=None, stats=None, mark_missing=True):
+    """Run RTA mapping, brokerage matching, checks, Regular vs Direct and the DIRECT filter on a block of rows.
+
+    Returns (output frame with the OUTPUT_COLUMNS layout, rows removed as DIRECT). Warnings
+    are appended to notices as (kind, title, message) so a streamed run reports each once;
+    stage timings and match counts go to stats (a RunStats). Without mark_missing, trail
+    rates are left float64 (see mark_missing_rates).
+    """
+    status = status or (lambda text: None)
+    stats = stats or RunStats()
+    rows_in = len(switch_df)
+    
+    # The block is the working frame: callers hand over rows they no longer need, so no full copy
+    processed_df = switch_df
+    use_switch_columns = switch_columns['use_switch_columns']
+    in_subfund_col = switch_columns['in_subfund']
+    out_subfund_col = switch_columns['out_subfund']
+    si_asset_col = switch_columns['si_asset']
+    so_asset_col = switch_columns['so_asset']
+    in_broker_col = switch_columns['in_broker']
+    out_broker_col = switch_columns['out_broker']
+    brokerage_index = refs.brokerage_index
+    
+    stage = stats.start('RTA map', rows_in)
+    # Broker / subfund / asset codes have a few hundred distinct values: store them as categoricals
+    # so every normalization below runs once per distinct code instead of once per row
+    for key in ('in_broker', 'out_broker', 'in_subfund', 'out_subfund', 'si_asset', 'so_asset'):
+        if switch_columns[key] is not None:
+            processed_df[switch_columns[key]] = categorize(processed_df[switch_columns[key]])
+    
+    if use_switch_columns:
+        # Use IN/OUT broker, subfund, and asset columns directly from Switch Register (no RTA)
+        processed_df['IN subfund code'] = map_distinct(processed_df[in_subfund_col], lambda u: u.astype(str).str.strip())
+        processed_df['out subfund code'] = map_distinct(processed_df[out_subfund_col], lambda u: u.astype(str).str.strip())
+        if si_asset_col:
+            processed_df['IN ASSET_CLASS'] = map_distinct(processed_df[si_asset_col], lambda u: u.fillna('Not Found').astype(str).str.strip())
+        else:
+            processed_df['IN ASSET_CLASS'] = 'Not Found'
+        if so_asset_col:
+            processed_df['out ASSET_CLASS'] = map_distinct(processed_df[so_asset_col], lambda u: u.fillna('Not Found').astype(str).str.strip())
+        else:
+            processed_df['out ASSET_CLASS'] = 'Not Found'
+    else:
+        # Process Switch Register: Extract scheme codes from "From" and "Scheme :" columns, then RTA
+        # Function to extract scheme code (part before "/")
+        def extract_scheme_code(value):
+            if pd.isna(value):
+                return None
+            value_str = str(value)
+            if '/' in value_str:
+                scheme_code = value_str.split('/')[0].strip()
+                return scheme_code
+            return None
+        
+        # Find "From" column (case-insensitive)
+        from_col = None
+        for col in processed_df.columns:
+            if str(col).upper().strip() == 'FROM':
+                from_col = col
+                break
+        
+        # Find "Scheme :" column (case-insensitive, handle variations)
+        scheme_col = None
+        for col in processed_df.columns:
+            col_upper = str(col).upper().strip()
+            if col_upper == 'SCHEME :' or col_upper == 'SCHEME:' or col_upper == 'SCHEME':
+                scheme_col = col
+                break
+        
+        # Process "From" column
+        if from_col:
+            # Extract scheme code and add as "out Scheme Code" at the start
+            out_scheme_codes = processed_df[from_col].apply(extract_scheme_code)
+            processed_df.insert(0, 'out Scheme Code', out_scheme_codes)
+            
+            # Rename "From" column to "switch out scheme"
+            processed_df = processed_df.rename(columns={from_col: 'switch out scheme'})
+        else:
+            # If "From" column not found, show warning but continue
+            notices.append(('warning', "Warning",
+                            "From column not found in Switch Register. Processing without out scheme code extraction."))
+            # Add empty column
+            processed_df.insert(0, 'out Scheme Code', None)
+        
+        # Process "Scheme :" column
+        if scheme_col:
+            # Extract scheme code and add as "IN Scheme Code" after "out Scheme Code"
+            in_scheme_codes = processed_df[scheme_col].apply(extract_scheme_code)
+            # Find position after "out Scheme Code"
+            out_scheme_code_idx = list(processed_df.columns).index('out Scheme Code')
+            processed_df.insert(out_scheme_code_idx + 1, 'IN Scheme Code', in_scheme_codes)
+            
+            # Rename "Scheme :" column to "switch in scheme"
+            processed_df = processed_df.rename(columns={scheme_col: 'switch in scheme'})
+        else:
+            # If "Scheme :" column not found, show warning but continue
+            notices.append(('warning', "Warning",
+                            "Scheme : column not found in Switch Register. Processing without IN scheme code extraction."))
+            # Add empty column after "out Scheme Code"
+            out_scheme_code_idx = list(processed_df.columns).index('out Scheme Code')
+            processed_df.insert(out_scheme_code_idx + 1, 'IN Scheme Code', None)
+        
+        status("Matching scheme codes with RTA Master...")
+        
+        # Scheme_code -> PARENT_SUB_FUND_CODE / ASSET_CLASS maps, built once per run from the RTA Master
+        subfund_mapping = refs.subfund_mapping
+        asset_class_mapping = refs.asset_class_mapping
+        
+        if subfund_mapping is not None:
+            # Match "out Scheme Code" with Scheme_code and get PARENT_SUB_FUND_CODE
+            if 'out Scheme Code' in processed_df.columns:
+                processed_df['out Scheme Code'] = processed_df['out Scheme Code'].astype(str).str.strip()
+                processed_df['out subfund code'] = processed_df['out Scheme Code'].map(subfund_mapping)
+                processed_df['out subfund code'] = processed_df['out subfund code'].fillna('Not Found')
+                
+                # Get ASSET_CLASS for "out Scheme Code"
+                if asset_class_mapping:
+                    processed_df['out ASSET_CLASS'] = processed_df['out Scheme Code'].map(asset_class_mapping)
+                    processed_df['out ASSET_CLASS'] = categorize(processed_df['out ASSET_CLASS'].fillna('Not Found'))
+                else:
+                    processed_df['out ASSET_CLASS'] = 'Not Found'
+                
+                # Insert "out subfund code" right after "out Scheme Code"
+                cols = list(processed_df.columns)
+                out_scheme_idx = cols.index('out Scheme Code')
+                out_subfund = processed_df.pop('out subfund code')
+                out_asset_class = processed_df.pop('out ASSET_CLASS')
+                processed_df.insert(out_scheme_idx + 1, 'out subfund code', out_subfund)
+                processed_df.insert(out_scheme_idx + 2, 'out ASSET_CLASS', out_asset_class)
+            else:
+                processed_df['out subfund code'] = 'Not Found'
+                processed_df['out ASSET_CLASS'] = 'Not Found'
+            
+            # Match "IN Scheme Code" with Scheme_code and get PARENT_SUB_FUND_CODE
+            if 'IN Scheme Code' in processed_df.columns:
+                processed_df['IN Scheme Code'] = processed_df['IN Scheme Code'].astype(str).str.strip()
+                processed_df['IN subfund code'] = processed_df['IN Scheme Code'].map(subfund_mapping)
+                processed_df['IN subfund code'] = processed_df['IN subfund code'].fillna('Not Found')
+                
+                if asset_class_mapping:
+                    processed_df['IN ASSET_CLASS'] = processed_df['IN Scheme Code'].map(asset_class_mapping)
+                    processed_df['IN ASSET_CLASS'] = categorize(processed_df['IN ASSET_CLASS'].fillna('Not Found'))
+                else:
+                    processed_df['IN ASSET_CLASS'] = 'Not Found'
+                
+                cols = list(processed_df.columns)
+                in_scheme_idx = cols.index('IN Scheme Code')
+                in_subfund = processed_df.pop('IN subfund code')
+                in_asset_class = processed_df.pop('IN ASSET_CLASS')
+                processed_df.insert(in_scheme_idx + 1, 'IN subfund code', in_subfund)
+                processed_df.insert(in_scheme_idx + 2, 'IN ASSET_CLASS', in_asset_class)
+            else:
+                processed_df['IN subfund code'] = 'Not Found'
+                processed_df['IN ASSET_CLASS'] = 'Not Found'
+        else:
+            missing_cols = []
+            if not refs.rta_columns['scheme_code']:
+                missing_cols.append("Scheme_code")
+            if not refs.rta_columns['parent_sub_fund_code']:
+                missing_cols.append("PARENT_SUB_FUND_CODE")
+            
+            notices.append(('warning', "Warning",
+                            f"Columns not found in RTA Master: {', '.join(missing_cols)}\n"
+                            f"Subfund codes and ASSET_CLASS will not be added."))
+            processed_df['out subfund code'] = 'Not Found'
+            processed_df['out ASSET_CLASS'] = 'Not Found'
+            processed_df['IN subfund code'] = 'Not Found'
+            processed_df['IN ASSET_CLASS'] = 'Not Found'
+    
+    stats.stop(stage, rows_out=len(processed_df),
+               matched=int((processed_df['IN subfund code'].astype(object) != 'Not Found').sum()),
+               unmatched=int((processed_df['IN subfund code'].astype(object) == 'Not Found').sum()))
+    
+    status("Matching with Brokerage Structure...")
+    
+    # Match broker and IN subfund code with Brokerage Structure
+    if brokerage_index is not None:
+        # Columns found in Brokerage Structure (detected when the index was compiled)
+        cons_code_col = brokerage_index.columns['cons_code']
+        scheme_code_b_col = brokerage_index.columns['scheme_code']
+        trail_rate_cols = brokerage_index.columns['trail_rates']
+        
+        # Find broker column in Switch Register (flexible matching); use IN/OUT broker when available
+        broker_col = None
+        for col in processed_df.columns:
+            col_upper = str(col).upper().strip()
+            if 'BROK' in col_upper and ('DLR' in col_upper or 'DEALER' in col_upper):
+                broker_col = col
+                break
+            elif col_upper == 'BROKER' or col_upper == 'BROKER CODE' or col_upper == 'BROKER_CODE':
+                broker_col = col
+                break
+        if use_switch_columns:
+            broker_col = in_broker_col  # for switch-in trail matching
+            broker_col_out = out_broker_col  # for switch-out trail matching
+        else:
+            broker_col_out = broker_col
+            if broker_col:
+                processed_df[broker_col] = categorize(processed_df[broker_col])
+        
+        # Find transaction date column in Switch Register (prefer OUT_TRADE_ from Switch Register)
+        tran_date_col = None
+        for col in processed_df.columns:
+            col_upper = str(col).upper().strip()
+            if col_upper in ('OUT_TRADE_', 'OUT_TRADE', 'OUT TRADE'):
+                tran_date_col = col
+                break
+            elif 'TRAN' in col_upper and 'DATE' in col_upper:
+                tran_date_col = col
+                break
+            elif col_upper == 'TRANSACTION DATE' or col_upper == 'TRANSACTION_DATE':
+                tran_date_col = col
+                break
+            elif col_upper == 'DATE':
+                tran_date_col = col
+                break
+        
+        if cons_code_col and scheme_code_b_col and broker_col:
+            # Convert transaction date in processed_df if column exists
+            if tran_date_col and tran_date_col in processed_df.columns:
+                processed_df['_TRAN_DATE_DT'] = pd.to_datetime(
+                    processed_df[tran_date_col], 
+                    errors='coerce',
+                    dayfirst=True
+                )
+            else:
+                processed_df['_TRAN_DATE_DT'] = pd.NaT
+            
+            # Vectorized interval join: (broker, subfund) + Investment Period From/To,
+            # IN and OUT legs resolved together in one pass
+            stage = stats.start('IN match', len(processed_df))
+            in_codes = brokerage_index.key_codes(processed_df[broker_col], processed_df['IN subfund code'])
+            match_count = int((in_codes >= 0).sum())
+            no_match_count = len(processed_df) - match_count
+            stats.stop(stage, rows_out=len(in_codes), matched=match_count, unmatched=no_match_count)
+            stage = stats.start('OUT match', len(processed_df))
+            if broker_col_out and broker_col_out in processed_df.columns:
+                out_codes = brokerage_index.key_codes(processed_df[broker_col_out], processed_df['out subfund code'])
+            else:
+                out_codes = np.full(len(processed_df), -1, dtype=np.int64)
+            match_count_out = int((out_codes >= 0).sum())
+            no_match_count_out = len(processed_df) - match_count_out
+            stats.stop(stage, rows_out=len(out_codes), matched=match_count_out, unmatched=no_match_count_out)
+            stage = stats.start('Investment period lookup', 2 * len(processed_df))
+            (in_current_rows, in_previous_rows), (out_current_rows, out_previous_rows) = brokerage_index.lookup_legs(
+                [in_codes, out_codes], processed_df['_TRAN_DATE_DT']
+            )
+            
+            # Trail rates for every detected year (1 year is always reported), as float64 with NaN for missing
+            trail_years = sorted(set(trail_rate_cols) | {1})
+            for year in trail_years:
+                role = f'trail_rate_{year}'
+                processed_df[f'switch in Trail Rate {year} year'] = brokerage_index.take_rate(role, in_current_rows)
+                processed_df[f'PREVIOUS switch in Trail Rate {year} year'] = brokerage_index.take_rate(role, in_previous_rows)
+                processed_df[f'switch out Trail Rate {year} year'] = brokerage_index.take_rate(role, out_current_rows)
+                processed_df[f'PREVIOUS switch out Trail Rate {year} year'] = brokerage_index.take_rate(role, out_previous_rows)
+            
+            # Why a year-1 rate is missing: no brokerage row vs. a matched row with a blank rate
+            processed_df['switch in Trail Rate Status'] = brokerage_index.rate_status('trail_rate_1', in_current_rows)
+            processed_df['switch out Trail Rate Status'] = brokerage_index.rate_status('trail_rate_1', out_current_rows)
+            
+            # Add Investment Period columns (from current IN match)
+            processed_df['Investment Period From'] = brokerage_index.take('period_from', in_current_rows)
+            processed_df['Investment Period To'] = brokerage_index.take('period_to', in_current_rows)
+            found = int((in_current_rows >= 0).sum() + (out_current_rows >= 0).sum())
+            stats.stop(stage, rows_out=2 * len(processed_df), matched=found, unmatched=2 * len(processed_df) - found)
+            
+            # Add check columns (vectorized; NaN never compares true, so missing rates give '')
+            status("Calculating checks...")
+            stage = stats.start('Checks', len(processed_df))
+            
+            # Check 1 year: switch in > switch out
+            processed_df['Check 1 year'] = np.where(
+                processed_df['switch in Trail Rate 1 year'] > processed_df['switch out Trail Rate 1 year'],
+                'Check', ''
+            )
+            
+            # Previous vs current: PREVIOUS switch in Trail Rate 1 year < switch in Trail Rate 1 year
+            processed_df['PREVIOUS switch in Trail Rate 1 year Check'] = np.where(
+                processed_df['PREVIOUS switch in Trail Rate 1 year'] < processed_df['switch in Trail Rate 1 year'],
+                'Check', ''
+            )
+            flagged = int(((processed_df['Check 1 year'] == 'Check') |
+                           (processed_df['PREVIOUS switch in Trail Rate 1 year Check'] == 'Check')).sum())
+            stats.stop(stage, rows_out=len(processed_df), matched=flagged, unmatched=len(processed_df) - flagged)
+        else:
+            # Missing required columns
+            missing_cols = []
+            if not cons_code_col:
+                missing_cols.append("Cons Code")
+            if not scheme_code_b_col:
+                missing_cols.append("Scheme Code")
+            if not broker_col:
+                missing_cols.append("Broker Column (BROK_DLR_N or similar)")
+            
+            notices.append(('warning', "Warning",
+                            f"Columns not found:\n"
+                            f"Brokerage Structure: {', '.join([c for c in missing_cols if c != 'Broker Column (BROK_DLR_N or similar)'])}\n"
+                            f"Switch Register: {', '.join([c for c in missing_cols if c == 'Broker Column (BROK_DLR_N or similar)'])}\n"
+                            f"Trail rates will not be added."))
+            # Add empty trail rate columns
+            processed_df['switch in Trail Rate 1 year'] = np.nan
+            processed_df['PREVIOUS switch in Trail Rate 1 year'] = np.nan
+            processed_df['switch out Trail Rate 1 year'] = np.nan
+            processed_df['PREVIOUS switch out Trail Rate 1 year'] = np.nan
+            processed_df['Check 1 year'] = ''
+            processed_df['PREVIOUS switch in Trail Rate 1 year Check'] = ''
+            processed_df['Investment Period From'] = 'Not Found'
+            processed_df['Investment Period To'] = 'Not Found'
+            not_found = pd.Categorical(['Not Found'] * len(processed_df), categories=RATE_STATUS_CATEGORIES)
+            processed_df['switch in Trail Rate Status'] = not_found
+            processed_df['switch out Trail Rate Status'] = not_found
+    else:
+        # No brokerage structure data
+        processed_df['switch in Trail Rate 1 year'] = np.nan
+        processed_df['PREVIOUS switch in Trail Rate 1 year'] = np.nan
+        processed_df['switch out Trail Rate 1 year'] = np.nan
+        processed_df['PREVIOUS switch out Trail Rate 1 year'] = np.nan
+        processed_df['Check 1 year'] = ''
+        processed_df['PREVIOUS switch in Trail Rate 1 year Check'] = ''
+        processed_df['Investment Period From'] = 'Not Found'
+        processed_df['Investment Period To'] = 'Not Found'
+        not_found = pd.Categorical(['Not Found'] * len(processed_df), categories=RATE_STATUS_CATEGORIES)
+        processed_df['switch in Trail Rate Status'] = not_found
+        processed_df['switch out Trail Rate Status'] = not_found
+    
+    # Add check for Regular vs Direct scheme matching
+    status("Checking Regular vs Direct scheme matches...")
+    
+    # Find switch in/out scheme columns (IN_SCHEME_, OUT_SCHEM0/OUT_SCHEME or legacy)
+    in_scheme_col = None
+    out_scheme_col = None
+    for col in processed_df.columns:
+        col_str = str(col).strip()
+        c = _norm(col)
+        # Exact match first (user's columns: IN_SCHEME_, OUT_SCHEM0)
+        if col_str.upper() in ('IN_SCHEME_', 'IN_SCHEME'):
+            in_scheme_col = col
+        if col_str.upper() in ('OUT_SCHEM0', 'OUT_SCHEME'):
+            out_scheme_col = col
+    if not in_scheme_col:
+        for col in processed_df.columns:
+            c = _norm(col)
+            if 'IN_SCHEME' in c or c in ('IN_SCHEME_', 'INSCHEME', 'SCHEME_IN'):
+                in_scheme_col = col
+                break
+    if not out_scheme_col:
+        for col in processed_df.columns:
+            c = _norm(col)
+            if 'OUT_SCHEM' in c or 'OUT_SCHEME' in c or c in ('OUTSCHEME', 'SCHEME_OUT'):
+                out_scheme_col = col
+                break
+    if not in_scheme_col and 'switch in scheme' in processed_df.columns:
+        in_scheme_col = 'switch in scheme'
+    if not out_scheme_col and 'switch out scheme' in processed_df.columns:
+        out_scheme_col = 'switch out scheme'
+    
+    # Scheme code columns for the scheme-family lookup: codes extracted for the RTA
+    # mapping, or IN_SCHEME / OUT_SCHEME when they are not the scheme name columns
+    in_code_col = 'IN Scheme Code' if 'IN Scheme Code' in processed_df.columns else None
+    out_code_col = 'out Scheme Code' if 'out Scheme Code' in processed_df.columns else None
+    for col in processed_df.columns:
+        c = _norm(col)
+        if not in_code_col and c == 'IN_SCHEME' and col != in_scheme_col:
+            in_code_col = col
+        if not out_code_col and c == 'OUT_SCHEME' and col != out_scheme_col:
+            out_code_col = col
+    
+    # Add the check column: O(1) family lookup per row, fuzzy name matching only for codes the index lacks
+    stage = stats.start('Regular vs Direct', len(processed_df))
+    regular_direct = np.full(len(processed_df), '', dtype=object)
+    unresolved = np.ones(len(processed_df), dtype=bool)
+    if refs.scheme_family_index is not None and in_code_col and out_code_col:
+        family_result, resolved = refs.scheme_family_index.checks(processed_df[in_code_col], processed_df[out_code_col])
+        regular_direct[resolved] = family_result[resolved]
+        unresolved = ~resolved
+    if in_scheme_col and out_scheme_col and in_scheme_col in processed_df.columns and out_scheme_col in processed_df.columns:
+        if unresolved.any():
+            regular_direct[unresolved] = regular_direct_checks(
+                processed_df.loc[unresolved, in_scheme_col], processed_df.loc[unresolved, out_scheme_col]
+            )
+        processed_df['Regular vs Direct Check'] = regular_direct
+    else:
+        processed_df['Regular vs Direct Check'] = regular_direct
+        if not in_scheme_col or not out_scheme_col:
+            cols_found = [c for c in processed_df.columns if 'SCHEME' in str(c).upper() or 'SCHEM' in str(c).upper()]
+            notices.append(('warning', "Regular vs Direct Check",
+                            f"Could not find scheme columns for Regular vs Direct check.\n"
+                            f"Looking for: IN_SCHEME_ (or IN_SCHEME), OUT_SCHEM0 (or OUT_SCHEME)\n"
+                            f"Columns with SCHEME in name: {cols_found[:10] if cols_found else 'None'}"))
+    
+    flagged = int((regular_direct != '').sum())
+    stats.stop(stage, rows_out=len(processed_df), matched=flagged, unmatched=len(processed_df) - flagged)
+    
+    # Remove rows where broker is "DIRECT"
+    status("Filtering out DIRECT broker entries...")
+    stage = stats.start('DIRECT filter', len(processed_df))
+    
+    # Find broker column for DIRECT filter (use OUT_BROKER when we have IN/OUT columns)
+    broker_col_filter = None
+    if use_switch_columns and out_broker_col and out_broker_col in processed_df.columns:
+        broker_col_filter = out_broker_col
+    else:
+        for col in processed_df.columns:
+            col_upper = str(col).upper().strip()
+            if 'BROK' in col_upper and ('DLR' in col_upper or 'DEALER' in col_upper):
+                broker_col_filter = col
+                break
+            elif col_upper == 'BROKER' or col_upper == 'BROKER CODE' or col_upper == 'BROKER_CODE':
+                broker_col_filter = col
+                break
+    
+    removed_count = 0
+    if broker_col_filter and broker_col_filter in processed_df.columns:
+        initial_count = len(processed_df)
+        # Filter out rows where broker is "DIRECT" (case-insensitive)
+        processed_df = processed_df[
+            ~mask_distinct(processed_df[broker_col_filter], lambda u: u.astype(str).str.strip().str.upper().eq('DIRECT'))
+        ]
+        removed_count = initial_count - len(processed_df)
+        if removed_count > 0:
+            print(f"\n=== Removed {removed_count} rows with DIRECT broker ===")
+    else:
+        print("\n=== Warning: Broker column not found, skipping DIRECT filter ===")
+    
+    stats.stop(stage, rows_out=len(processed_df), matched=removed_count)
+    
+    # Output only OUTPUT_COLUMNS, in that exact order
+    output_columns = list(OUTPUT_COLUMNS)
+    # Trail Rate 2-5 year columns (clawback analysis), only for years the Brokerage Structure has
+    for year in range(2, 6):
+        if f'switch in Trail Rate {year} year' in processed_df.columns:
+            output_columns += [
+                f'switch in Trail Rate {year} year', f'PREVIOUS switch in Trail Rate {year} year',
+                f'switch out Trail Rate {year} year', f'PREVIOUS switch out Trail Rate {year} year'
+            ]
+    final_cols = []
+    for col in output_columns:
+        if col in processed_df.columns:
+            final_cols.append(col)
+        else:
+            processed_df[col] = ''
+            final_cols.append(col)
+    processed_df = processed_df[final_cols]
+    if mark_missing:
+        processed_df = mark_missing_rates(processed_df)
+    
+    return processed_df, removed_count
+
+
+def mark_missing_rates(processed_df):
+    """Output file form of the trail rate columns: float64 rates with 'Not Found' for missing values"""
+    # Trail rates stay float64 through processing; the 'Not Found' marker is only for the output file
+    for col in processed_df.columns:
+        if 'Trail Rate' in col and not col.endswith('Check') and pd.api.types.is_float_dtype(processed_df[col]):
+            processed_df[col] = processed_df[col].astype(object).where(processed_df[col].notna(), 'Not Found')
+    return processed_df
+
+
+class SwitchPipelineError(Exception):
+    """A problem to report to the user as-is: dialog kind ('error' / 'warning'), title, message, and an
+    optional status-bar text"""
+
+    def __init__(self, title, message, kind='error', status=None):
+        super().__init__(title, message, kind, status)  # all four in args, so it survives worker pickling
+        self.title = title
+        self.message = message
+        self.kind = kind
+        self.status = status
+
+    def __str__(self):
+        return self.message
+
+
+def write_switch_output(processed_df, save_path, stats=None):
+    """Write processed rows to CSV or Excel; with stats, Excel output gets a Run Stats sheet"""
+    # CSV: very fast even for millions of rows (recommended for large files)
+    if save_path.lower().endswith('.csv'):
+        processed_df.to_csv(save_path, index=False, encoding='utf-8-sig')
+        return
+    # Excel: can be slow for 20k+ rows — use CSV for large files
+    engine = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+    with pd.ExcelWriter(save_path, engine=engine) as writer:
+        processed_df.to_excel(writer, sheet_name='Processed Data', index=False)
+        if stats is not None:
+            # The write stage itself is still running, so the sheet covers every stage before it
+            stats.to_frame().to_excel(writer, sheet_name='Run Stats', index=False)
+
+
+def register_row_keys(switch_df):
+    """Incremental mode row hashes: (identity from SL_NO / USER_TRXNN plus OUT_TRADE_, content of every
+    loaded column, OUT_TRADE_ column), or None when the register lacks those columns"""
+    by_name = {_norm(col): col for col in switch_df.columns}
+    key_cols = [by_name[name] for name in RESULT_KEY_COLUMNS if name in by_name]
+    date_col = by_name.get(RESULT_DATE_COLUMN)
+    if not key_cols or date_col is None:
+        return None
+    key_cols.append(date_col)
+    # Each column is hashed once; identity and content combine the column hashes in column order.
+    # Text columns are hashed per distinct value (a categorical hashes like its values)
+    keys = np.zeros(len(switch_df), dtype=np.uint64)
+    content = np.zeros(len(switch_df), dtype=np.uint64)
+    for col in switch_df.columns:
+        column_hash = pd.util.hash_pandas_object(categorize(switch_df[col]), index=False).to_numpy()
+        if col in key_cols:
+            keys = keys * np.uint64(1000003) ^ column_hash
+        content = content * np.uint64(1000003) ^ column_hash
+    return keys, content, date_col
+
+
+class ResultStore:
+    """Processed Switch Register rows of earlier runs, for incremental mode.
+
+    Each row is identified by a hash of SL_NO / USER_TRXNN plus OUT_TRADE_ and is reused
+    only while the hash of its loaded columns is unchanged, so amended rows are matched
+    again. DIRECT rows are recorded without an output row, so they are not re-matched
+    every run either. Stores are keyed by the Brokerage Structure content key, the RTA
+    Master's SHA-256 and the register's columns: a changed input starts a new store.
+
+    Each run appends its new output rows (trail rates still float64) as one Feather
+    partition; rows replaced by amended ones stay behind until they outnumber the live
+    rows, when the store is rewritten. The high-water mark (rows held, latest
+    OUT_TRADE_) is kept in meta.json, which is replaced last and so commits each run.
+    """
+
+    def __init__(self, context_key):
+        self.path = os.path.join(RESULT_STORE_DIR, context_key)
+        self.keys = np.array([], dtype=np.uint64)
+        self.content = np.array([], dtype=np.uint64)
+        self.out_row = np.array([], dtype=np.int64)  # row in self.rows, -1 for DIRECT rows
+        self.rows = None  # stored output rows, all partitions; None until the first run is stored
+        self.pending = None  # output rows added this run, appended to self.rows on save
+        self.meta = {'version': RESULT_STORE_VERSION, 'generation': 0, 'partitions': [], 'rows': 0,
+                     'last_trade_date': None, 'notices': []}
+
+    @classmethod
+    def load(cls, context_key):
+        """The stored results for this context (an empty store when there are none or they are unreadable)"""
+        store = cls(context_key)
+        meta_path = os.path.join(store.path, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return store
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != RESULT_STORE_VERSION:
+                return store
+            with np.load(os.path.join(store.path, f"index-{meta['generation']}.npz"), allow_pickle=False) as index:
+                keys, content, out_row = index['keys'], index['content'], index['out_row']
+            rows = pd.concat([load_frame(os.path.join(store.path, name)) for name in meta['partitions']],
+                             ignore_index=True)
+            if len(keys) != len(content) or len(keys) != len(out_row) or out_row.max(initial=-1) >= len(rows):
+                raise ValueError("index does not match the stored rows")
+        except (OSError, ValueError, KeyError, TypeError, ImportError) as e:
+            print(f"\n=== Warning: could not read result store, processing all rows: {e} ===")
+            return store
+        os.utime(store.path)  # mark as recently used
+        store.keys, store.content, store.out_row, store.rows, store.meta = keys, content, out_row, rows, meta
+        return store
+
+    def find(self, keys, content):
+        """Stored position of each row, -1 where the row is new or its content changed"""
+        found = pd.Index(self.keys).get_indexer(keys)
+        hit = found >= 0
+        hit[hit] = self.content[found[hit]] == content[hit]
+        return np.where(hit, found, -1)
+
+    def add(self, keys, content, positions, new_out, trade_dates):
+        """Record newly matched rows: their hashes and register positions, and the output rows that
+        survived the DIRECT filter (indexed by register position). Replaces stored rows with the same key."""
+        out_row = new_out.index.get_indexer(positions)
+        # A key repeated in the register keeps its last row
+        last = ~pd.Index(keys).duplicated(keep='last')
+        keys, content, out_row = keys[last], content[last], out_row[last]
+        keep = ~np.isin(self.keys, keys)
+        base = 0 if self.rows is None else len(self.rows)
+        self.keys = np.concatenate([self.keys[keep], keys])
+        self.content = np.concatenate([self.content[keep], content])
+        self.out_row = np.concatenate([self.out_row[keep], np.where(out_row >= 0, out_row + base, -1)])
+        self.pending = new_out.reset_index(drop=True)
+        latest = pd.to_datetime(trade_dates, errors='coerce', dayfirst=True).max()
+        if pd.notna(latest):
+            previous = self.meta['last_trade_date']
+            self.meta['last_trade_date'] = max(filter(None, [previous, latest.isoformat()]))
+        self.meta['rows'] = len(self.keys)
+
+    def save(self):
+        """Append this run's rows as a new partition, or rewrite the store when it is new or mostly stale"""
+        if self.pending is None:
+            return
+        live = int((self.out_row >= 0).sum())
+        stored = (0 if self.rows is None else len(self.rows)) + len(self.pending)
+        self.meta['updated'] = datetime.now().isoformat(timespec='seconds')
+        if self.rows is None or stored - live > live:
+            self._rewrite()
+            return
+        generation = self.meta['generation'] + 1
+        partition = f'rows-{generation:06d}'
+        save_frame(self.pending, os.path.join(self.path, partition))
+        np.savez(os.path.join(self.path, f'index-{generation}.npz'),
+                 keys=self.keys, content=self.content, out_row=self.out_row)
+        meta = dict(self.meta, generation=generation, partitions=self.meta['partitions'] + [partition])
+        tmp = os.path.join(self.path, f'meta.json.tmp{os.getpid()}')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2, default=str)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+        os.remove(os.path.join(self.path, f"index-{self.meta['generation']}.npz"))
+        self.meta = meta
+
+    def _rewrite(self):
+        """Write only the live rows as a single partition, replacing the store directory atomically"""
+        rows = self.pending if self.rows is None else pd.concat([self.rows, self.pending], ignore_index=True)
+        has_row = self.out_row >= 0
+        rows = rows.take(self.out_row[has_row])
+        self.out_row = self.out_row.copy()
+        self.out_row[has_row] = np.arange(int(has_row.sum()))
+        tmp = f'{self.path}.tmp{os.getpid()}'
+        os.makedirs(tmp, exist_ok=True)
+        save_frame(rows, os.path.join(tmp, 'rows-000000'))
+        np.savez(os.path.join(tmp, 'index-0.npz'), keys=self.keys, content=self.content, out_row=self.out_row)
+        self.meta.update(generation=0, partitions=['rows-000000'])
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2, default=str)
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp, self.path)
+
+        # Keep only the most recent stores
+        entries = [os.path.join(RESULT_STORE_DIR, d) for d in os.listdir(RESULT_STORE_DIR)]
+        entries = sorted((e for e in entries if os.path.isdir(e) and '.tmp' not in e), key=os.path.getmtime, reverse=True)
+        for stale in entries[RESULT_STORE_KEEP:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+class SwitchEngine:
+    """GUI-free Switch Register pipeline.
+
+    Holds the Brokerage Structure / RTA Master inputs and, once loaded, the SwitchReferences
+    built from them, so any number of registers are processed against one index. Progress
+    goes to status(text); problems for the user are raised as SwitchPipelineError. A known
+    brokerage_key (from an engine that already hashed the same files) skips re-hashing them.
+    """
+
+    def __init__(self, brokerage_paths, rta_path=None, status=None, brokerage_key=None):
+        self.brokerage_paths = list(brokerage_paths)
+        self.rta_path = rta_path or None
+        self.status = status or (lambda text: None)
+        self.brokerage_key = brokerage_key or brokerage_content_key(self.brokerage_paths)
+        self.refs = None
+        self.index_saved = False  # True when worker processes can memory-map the index from the cache
+    
+    def check_register(self, switch_path):
+        """Header pre-pass for one Switch Register: returns (detected columns, columns to load)"""
+        switch_header, dupes = read_input_header(switch_path)
+        
+        # Check for duplicate columns
+        if dupes:
+            raise SwitchPipelineError(
+                "Error",
+                f"Switch Register file has duplicate column names: {dupes}. Please fix the file and try again."
+            )
+        
+        # Detect if Switch Register has IN/OUT broker, subfund, and asset columns (no RTA needed)
+        switch_columns = detect_switch_columns(switch_header)
+        if switch_columns['use_switch_columns']:
+            self.status("Using broker/subfund/asset from Switch Register (no RTA)...")
+        elif not self.rta_path:
+            raise SwitchPipelineError(
+                "Incomplete Upload",
+                "Please upload RTA Master file, or use a Switch Register with columns: "
+                "IN_BROKER, IN_SUBFUND, OUT_BROKER, OUT_SUBFUN (or OUT_SUBFUND), SO_ASSET_C, SI_ASSET_C (or IN_ASSET_C).",
+                kind='warning'
+            )
+        return switch_columns, switch_register_usecols(switch_header)
+    
+    def load(self, switch_path=None, switch_usecols=None, stats=None):
+        """Build the shared references: memory-map the compiled brokerage index (or parse and compile the
+        Brokerage Structure) and read the RTA Master. A Switch Register given here is parsed concurrently
+        with them and returned."""
+        stats = stats or RunStats()
+        
+        # Reuse the compiled brokerage index when these exact files were processed before
+        self.status("Loading Brokerage Structure index...")
+        stage = stats.start('Brokerage index load')
+        brokerage_index = BrokerageIndex.load(self.brokerage_key)
+        self.index_saved = brokerage_index is not None
+        stats.stop(stage, matched=brokerage_index is not None, unmatched=brokerage_index is None)
+        
+        # Header pre-pass: validate every input and resolve the columns to load before any full parse
+        self.status("Checking input file columns...")
+        read_stage = stats.start('Read inputs')
+        if self.rta_path:
+            rta_header, dupes = read_input_header(self.rta_path)
+            if dupes:
+                raise SwitchPipelineError(
+                    "Error",
+                    f"RTA Master file has duplicate column names: {dupes}. Please fix the file and try again."
+                )
+        
+        brokerage_headers = []
+        if brokerage_index is None:
+            for file_path in self.brokerage_paths:
+                brokerage_header, dupes = read_input_header(file_path)
+                # Check for duplicate columns
+                if dupes:
+                    raise SwitchPipelineError(
+                        "Error",
+                        f"Brokerage Structure file '{os.path.basename(file_path)}' has duplicate column names: {dupes}. "
+                        "Please fix the file and try again."
+                    )
+                brokerage_headers.append(brokerage_header)
+        
+        # Parse every input that is needed (Switch Register, RTA Master, Brokerage Structure
+        # files on an index miss) concurrently in worker processes, only the columns in use
+        self.status("Reading input files...")
+        read_paths = [switch_path] if switch_path else []
+        read_usecols = [switch_usecols] if switch_path else []
+        if self.rta_path:
+            read_paths.append(self.rta_path)
+            read_usecols.append(rta_master_usecols(rta_header))
+        read_paths.extend(self.brokerage_paths if brokerage_index is None else [])
+        read_usecols.extend(brokerage_usecols(header) for header in brokerage_headers)
+        inputs = read_input_files(read_paths, read_usecols)
+        switch_df = inputs.pop(0) if switch_path else None
+        stats.stop(read_stage, rows_out=sum(len(df) for df in inputs) + (0 if switch_df is None else len(switch_df)))
+        
+        # RTA Master: required for subfund mapping without IN/OUT columns, and used for the
+        # scheme-family index (Regular vs Direct) whenever it is uploaded
+        rta_df = inputs.pop(0) if self.rta_path else None
+        
+        if brokerage_index is None:
+            # Brokerage Structure files were parsed above with the other inputs
+            brokerage_dfs = inputs
+            
+            # Combine all brokerage structure files
+            if len(brokerage_dfs) > 1:
+                combined_brokerage_df = pd.concat(brokerage_dfs, ignore_index=True)
+            else:
+                combined_brokerage_df = brokerage_dfs[0] if brokerage_dfs else pd.DataFrame()
+            
+            if not combined_brokerage_df.empty:
+                self.status("Compiling Brokerage Structure index...")
+                stage = stats.start('Brokerage index compile', rows_in=len(combined_brokerage_df))
+                brokerage_index = BrokerageIndex.compile(combined_brokerage_df)
+                stats.stop(stage, rows_out=brokerage_index.meta['indexed_rows'])
+                if brokerage_index.is_complete:
+                    try:
+                        brokerage_index.save(self.brokerage_key)
+                        self.index_saved = True
+                    except OSError as e:
+                        print(f"\n=== Warning: could not save brokerage index: {e} ===")
+        
+        # Reference data is built once and shared by every register and every block of rows
+        self.refs = SwitchReferences(brokerage_index, rta_df)
+        return switch_df
+    
+    def result_store_key(self, switch_columns):
+        """Result store context: store version, Brokerage Structure content key, RTA Master SHA-256,
+        the register's loaded columns and the pandas version"""
+        payload = [RESULT_STORE_VERSION, self.brokerage_key, file_sha256(self.rta_path) if self.rta_path else None,
+                   [str(col) for col in switch_columns], pd.__version__]
+        return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+    
+    def process_incremental(self, switch_df, switch_columns, notices, stats):
+        """Incremental mode: match only the rows the result store has not seen (or that changed), then
+        regenerate the whole output from the store. Returns (output frame, rows removed as DIRECT, rows reused)."""
+        switch_df = switch_df.reset_index(drop=True)
+        self.status("Looking up processed rows...")
+        stage = stats.start('Result store lookup', len(switch_df))
+        row_keys = register_row_keys(switch_df)
+        if row_keys is None:
+            stats.stop(stage)
+            print(f"\n=== Incremental mode needs {' or '.join(RESULT_KEY_COLUMNS)} plus {RESULT_DATE_COLUMN} columns: "
+                  f"processing all rows ===")
+            processed_df, removed_count = process_switch_rows(switch_df, self.refs, switch_columns, notices,
+                                                              status=self.status, stats=stats)
+            return processed_df, removed_count, 0
+        keys, content, date_col = row_keys
+        store = ResultStore.load(self.result_store_key(switch_df.columns))
+        found = store.find(keys, content)
+        new_rows = np.flatnonzero(found < 0)
+        reused = np.flatnonzero(found >= 0)
+        stats.stop(stage, rows_out=len(switch_df), matched=len(reused), unmatched=len(new_rows))
+        print(f"\n=== Incremental: {len(reused)} rows from the result store "
+              f"(high-water mark: {store.meta['rows']} rows, {RESULT_DATE_COLUMN} {store.meta['last_trade_date']}), "
+              f"{len(new_rows)} new or changed rows to match ===")
+        
+        new_out = None
+        if len(new_rows) or store.rows is None:
+            new_df = switch_df if len(new_rows) == len(switch_df) else switch_df.take(new_rows)
+            trade_dates = new_df[date_col].copy()
+            new_notices = []
+            self.status(f"Processing {len(new_rows):,} new Switch Register rows...")
+            new_out, _ = process_switch_rows(new_df, self.refs, switch_columns, new_notices,
+                                             status=self.status, stats=stats, mark_missing=False)
+            del new_df
+            store.meta['notices'] = [list(n) for n in dict.fromkeys(map(tuple, store.meta['notices'] + new_notices))]
+        # Warnings come from the register layout, which is part of the store context: replay them every run
+        notices.extend(tuple(n) for n in store.meta['notices'])
+        
+        # Output in register order: each row's stored output, or its new one (DIRECT rows have neither)
+        stage = stats.start('Result store update', len(switch_df))
+        source = np.full(len(switch_df), -1, dtype=np.int64)
+        source[reused] = store.out_row[found[reused]]
+        parts = [] if store.rows is None else [store.rows]
+        if new_out is not None:
+            source[new_out.index.to_numpy()] = (0 if store.rows is None else len(store.rows)) + np.arange(len(new_out))
+            parts.append(new_out)
+        processed_df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        processed_df = mark_missing_rates(processed_df.take(source[source >= 0]).reset_index(drop=True))
+        removed_count = int((source < 0).sum())
+        
+        if new_out is not None:
+            store.add(keys[new_rows], content[new_rows], new_rows, new_out, trade_dates)
+            try:
+                store.save()
+            except (OSError, ValueError, ImportError) as e:
+                print(f"\n=== Warning: could not save result store: {e} ===")
+        stats.stop(stage, rows_out=len(processed_df), matched=len(reused), unmatched=len(new_rows))
+        return processed_df, removed_count, len(reused)
+    
+    def run(self, switch_path, output_path, notify=None, stats=None, run_stats=False, incremental=False):
+        """Process one Switch Register and write the result.
+
+        output_path is a path, or a callable(streaming) returning one (None cancels). When
+        streaming it is asked before processing, since blocks are written as they finish.
+        notify(kind, title, message) gets the warnings and the DIRECT filter summary. Returns
+        a dict with output_path (None when cancelled), row counts and the RunStats; with
+        run_stats the stage table is also saved as JSON (and a sheet, for Excel output).
+        With incremental, only rows the result store has not seen are matched (streamed
+        registers are always processed in full).
+        """
+        notify = notify or (lambda kind, title, message: None)
+        stats = stats or RunStats()
+        choose_output = output_path if callable(output_path) else (lambda streaming: output_path)
+        
+        # Very large CSV registers are streamed in blocks of rows instead of being loaded whole
+        streaming = (switch_path.lower().endswith('.csv')
+                     and os.path.getsize(switch_path) >= STREAMING_THRESHOLD_BYTES)
+        
+        self.status("Checking input file columns...")
+        switch_columns, switch_usecols = self.check_register(switch_path)
+        if self.refs is None:
+            switch_df = self.load(None if streaming else switch_path, switch_usecols, stats)
+        elif not streaming:
+            self.status("Reading input files...")
+            stage = stats.start('Read inputs')
+            switch_df = read_input_file(switch_path, switch_usecols)
+            stats.stop(stage, rows_out=len(switch_df))
+        
+        result = {'switch_path': switch_path, 'output_path': None, 'rows_read': 0, 'rows_written': 0,
+                  'rows_reused': 0, 'removed_count': 0, 'stats': stats}
+        notices = []
+        if streaming:
+            # Output goes straight to CSV, one block at a time, so the destination is chosen first
+            self.status("Preparing to save...")
+            save_path = choose_output(True)
+            if not save_path:
+                return result
+            if incremental:
+                print("\n=== Incremental mode does not apply to streamed registers: processing all rows ===")
+            
+            first_block = True
+            engine = 'arrow'
+            chunks = read_csv_blocks(switch_path, STREAMING_CHUNK_ROWS, switch_usecols or None, engine)
+            while True:
+                stage = stats.start('Read inputs')
+                try:
+                    chunk = next(chunks, None)
+                except ValueError as e:
+                    # A row Arrow's parser rejects (pyarrow.ArrowInvalid) part-way through: start over with pandas
+                    if engine == 'pandas':
+                        raise
+                    print(f"\n=== Arrow could not parse {os.path.basename(switch_path)} ({e}): "
+                          f"streaming it again with pandas ===")
+                    engine = 'pandas'
+                    chunks = read_csv_blocks(switch_path, STREAMING_CHUNK_ROWS, switch_usecols or None, engine)
+                    first_block = True
+                    result.update(rows_read=0, rows_written=0, removed_count=0)
+                    notices.clear()
+                    stats.stop(stage, rows_out=0)
+                    continue
+                stats.stop(stage, rows_out=0 if chunk is None else len(chunk))
+                if chunk is None:
+                    break
+                self.status(f"Processing rows {result['rows_read'] + 1:,}-{result['rows_read'] + len(chunk):,}...")
+                result['rows_read'] += len(chunk)
+                chunk_out, chunk_removed = process_switch_rows(chunk, self.refs, switch_columns, notices, stats=stats)
+                result['removed_count'] += chunk_removed
+                # Header and BOM are written once, with the first block
+                stage = stats.start('Write', rows_in=len(chunk_out))
+                chunk_out.to_csv(
+                    save_path, index=False,
+                    mode='w' if first_block else 'a',
+                    header=first_block,
+                    encoding='utf-8-sig' if first_block else 'utf-8'
+                )
+                stats.stop(stage, rows_out=len(chunk_out))
+                first_block = False
+                result['rows_written'] += len(chunk_out)
+                del chunk, chunk_out
+            print(f"\n=== Streamed {result['rows_read']} rows in blocks of {STREAMING_CHUNK_ROWS}, "
+                  f"wrote {result['rows_written']} ===")
+            self._notify(notify, notices, result)
+        else:
+            self.status("Processing Switch Register data...")
+            result['rows_read'] = len(switch_df)
+            if incremental:
+                processed_df, result['removed_count'], result['rows_reused'] = self.process_incremental(
+                    switch_df, switch_columns, notices, stats
+                )
+            else:
+                processed_df, result['removed_count'] = process_switch_rows(
+                    switch_df, self.refs, switch_columns, notices, status=self.status, stats=stats
+                )
+            switch_df = None
+            result['rows_written'] = len(processed_df)
+            
+            self.status("Processing complete...")
+            self._notify(notify, notices, result)
+            
+            self.status("Preparing to save...")
+            save_path = choose_output(False)
+            if not save_path:
+                return result
+            
+            self.status("Saving file...")
+            stage = stats.start('Write', rows_in=len(processed_df))
+            try:
+                write_switch_output(processed_df, save_path, stats if run_stats else None)
+            except Exception as e:
+                raise SwitchPipelineError("Error", f"Could not save file:\n{e}",
+                                          status="Status: Could not save file!") from e
+            stats.stop(stage, rows_out=len(processed_df))
+        
+        stats.report()
+        if run_stats:
+            stats.to_json(run_stats_path(save_path))
+        result['output_path'] = save_path
+        return result
+    
+    @staticmethod
+    def _notify(notify, notices, result):
+        """Report each distinct warning once, then the DIRECT filter summary"""
+        for kind, title, message in dict.fromkeys(notices):
+            notify(kind, title, message)
+        if result['removed_count'] > 0:
+            notify('info', "Filter Applied",
+                   f"Removed {result['removed_count']} row(s) where broker is 'DIRECT'.\n"
+                   f"Remaining rows: {result['rows_written']}")
+
+
+# Batch workers: one engine per process, attached to the references the parent loaded
+_batch_engine = None
+SWITCH_REGISTER_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.xlsb')
+
+
+def _init_batch_worker(brokerage_paths, rta_path, brokerage_key, refs):
+    """Process pool initializer: adopt the parent's references and brokerage key. The brokerage index
+    arrives detached when the parent saved it, and is memory-mapped from the cache so workers share its
+    pages; the parent's key keeps workers from re-hashing the files and always names the index it saved."""
+    global _batch_engine
+    _batch_engine = SwitchEngine(brokerage_paths, rta_path, brokerage_key=brokerage_key)
+    if refs.brokerage_index is None:
+        refs.brokerage_index = BrokerageIndex.load(_batch_engine.brokerage_key)
+    _batch_engine.refs = refs
+
+
+def _run_batch_register(switch_path, output_path, run_stats):
+    """Batch worker entry point: process one register, collecting notices instead of showing them"""
+    notices = []
+    result = _batch_engine.run(switch_path, output_path, notify=lambda *notice: notices.append(notice),
+                               run_stats=run_stats)
+    result['notices'] = notices
+    return result
+
+
+def process_directory(input_dir, output_dir, brokerage_paths, rta_path=None, output_format='csv',
+                      workers=None, run_stats=False, status=None):
+    """Process every Switch Register in input_dir into output_dir (<name>_processed.<format>).
+
+    The brokerage index and RTA Master are loaded once here and shared by parallel worker
+    processes. Returns {register path: result dict, or the exception that register raised}.
+    """
+    status = status or (lambda text: None)
+    registers = sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(SWITCH_REGISTER_EXTENSIONS) and not name.startswith('~$')
+    )
+    if not registers:
+        return {}
+    os.makedirs(output_dir, exist_ok=True)
+    
+    engine = SwitchEngine(brokerage_paths, rta_path, status=status)
+    engine.load()
+    shared_refs = engine.refs
+    if engine.index_saved:
+        # Ship the references without the index; workers memory-map the saved copy instead
+        shared_refs = SwitchReferences()
+        shared_refs.__dict__.update(engine.refs.__dict__, brokerage_index=None)
+    
+    results = dict.fromkeys(registers)  # reported in directory order, not completion order
+    workers = workers or min(len(registers), os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_batch_worker,
+        initargs=(engine.brokerage_paths, engine.rta_path, engine.brokerage_key, shared_refs)
+    ) as pool:
+        futures = {}
+        for switch_path in registers:
+            stem = os.path.splitext(os.path.basename(switch_path))[0]
+            output_path = os.path.join(output_dir, f'{stem}_processed.{output_format}')
+            futures[pool.submit(_run_batch_register, switch_path, output_path, run_stats)] = switch_path
+        for future in concurrent.futures.as_completed(futures):
+            switch_path = futures[future]
+            try:
+                results[switch_path] = future.result()
+                status(f"Processed {os.path.basename(switch_path)}")
+            except Exception as e:
+                results[switch_path] = e
+                status(f"Failed {os.path.basename(switch_path)}: {e}")
+    return results
+
 
 class LoadingWindow(ctk.CTkToplevel):
     def __init__(self, parent):
@@ -180,6 +2167,28 @@ class SwitchRegisterGUI:
             multiple=True
         )
         
+        # Optional per-stage timings alongside the output
+        self.run_stats_var = ctk.BooleanVar(value=False)
+        run_stats_check = ctk.CTkCheckBox(
+            upload_panel,
+            text="Save run stats (JSON + Run Stats sheet)",
+            variable=self.run_stats_var,
+            font=("Segoe UI", 11),
+            text_color="#b0b0b0"
+        )
+        run_stats_check.pack(anchor="w", padx=30, pady=(10, 0))
+        
+        # Incremental mode: only register rows not seen in earlier runs are matched
+        self.incremental_var = ctk.BooleanVar(value=False)
+        incremental_check = ctk.CTkCheckBox(
+            upload_panel,
+            text="Incremental (match only new register rows)",
+            variable=self.incremental_var,
+            font=("Segoe UI", 11),
+            text_color="#b0b0b0"
+        )
+        incremental_check.pack(anchor="w", padx=30, pady=(10, 0))
+        
         # Process button at bottom
         process_btn = ctk.CTkButton(
             upload_panel,
@@ -244,7 +2253,7 @@ class SwitchRegisterGUI:
         file_path = filedialog.askopenfilename(
             title="Select Switch Register File",
             filetypes=[
-                ("Excel files", "*.xlsx *.xls"),
+                ("Excel files", "*.xlsx *.xls *.xlsb"),
                 ("CSV files", "*.csv"),
                 ("All files", "*.*")
             ]
@@ -264,7 +2273,7 @@ class SwitchRegisterGUI:
         file_path = filedialog.askopenfilename(
             title="Select RTA Master File",
             filetypes=[
-                ("Excel files", "*.xlsx *.xls"),
+                ("Excel files", "*.xlsx *.xls *.xlsb"),
                 ("CSV files", "*.csv"),
                 ("All files", "*.*")
             ]
@@ -284,7 +2293,7 @@ class SwitchRegisterGUI:
         file_paths = filedialog.askopenfilenames(
             title="Select Brokerage Structure File(s)",
             filetypes=[
-                ("Excel files", "*.xlsx *.xls"),
+                ("Excel files", "*.xlsx *.xls *.xlsb"),
                 ("CSV files", "*.csv"),
                 ("All files", "*.*")
             ]
@@ -349,1159 +2358,39 @@ class SwitchRegisterGUI:
         # Show loading window
         loading_window = LoadingWindow(self.root)
         
+        save_run_stats = self.run_stats_var.get()
+        incremental = self.incremental_var.get()
+        engine = SwitchEngine(self.brokerage_structure_paths, self.rta_master_path, status=loading_window.update_status)
+        
+        def choose_output(streaming):
+            if streaming:
+                # Large registers are written block by block, to CSV only
+                return filedialog.asksaveasfilename(
+                    title="Save Processed File (large register: CSV output)",
+                    defaultextension=".csv",
+                    filetypes=[("CSV files", "*.csv")]
+                )
+            return filedialog.asksaveasfilename(
+                title="Save Processed File",
+                defaultextension=".xlsx",
+                filetypes=[
+                    ("Excel files", "*.xlsx"),
+                    ("CSV files (faster for large files)", "*.csv"),
+                    ("All files", "*.*")
+                ]
+            )
+        
+        def notify(kind, title, message):
+            self.root.after(0, lambda: (
+                messagebox.showwarning(title, message) if kind == 'warning' else messagebox.showinfo(title, message)
+            ))
+        
         def process_file():
             try:
-                loading_window.update_status("Reading Switch Register file...")
-                # Read Switch Register file
-                if self.switch_register_path.endswith('.csv'):
-                    switch_df = pd.read_csv(self.switch_register_path)
-                else:
-                    switch_df = pd.read_excel(self.switch_register_path)
-                
-                # Check for duplicate columns
-                if switch_df.columns.duplicated().any():
-                    dupes = switch_df.columns[switch_df.columns.duplicated()].tolist()
-                    self.root.after(0, lambda: messagebox.showerror(
-                        "Error",
-                        f"Switch Register file has duplicate column names: {dupes}. Please fix the file and try again."
-                    ))
-                    self.root.after(0, loading_window.stop)
-                    return
-                
-                # Detect if Switch Register has IN/OUT broker, subfund, and asset columns (no RTA needed)
-                # Normalize: strip and collapse spaces so "OUT SUBFUN" / "OUT_SUBFUN" both match
-                def _norm(s):
-                    try:
-                        t = str(s).upper().lstrip('\ufeff').strip()
-                        return ' '.join(t.split()).replace(' ', '_')
-                    except (TypeError, AttributeError):
-                        return ''
-                in_broker_col = None
-                in_subfund_col = None
-                out_broker_col = None
-                out_subfund_col = None
-                so_asset_col = None
-                si_asset_col = None
-                for col in switch_df.columns:
-                    try:
-                        c = _norm(col)
-                        c_spaces = c.replace('_', ' ')
-                        if c in ('IN_BROKER',) or c_spaces == 'IN BROKER':
-                            in_broker_col = col
-                        elif c in ('IN_SUBFUND', 'IN_SUBFUN',) or c_spaces in ('IN SUBFUND', 'IN SUBFUN'):
-                            in_subfund_col = col
-                        elif c in ('OUT_BROKER',) or c_spaces == 'OUT BROKER':
-                            out_broker_col = col
-                        elif c in ('OUT_SUBFUND', 'OUT_SUBFUN',) or c_spaces in ('OUT SUBFUND', 'OUT SUBFUN'):
-                            out_subfund_col = col
-                        elif c in ('SO_ASSET_C',) or c_spaces == 'SO ASSET C':
-                            so_asset_col = col
-                        elif c in ('SI_ASSET_C', 'IN_ASSET_C',) or c_spaces in ('SI ASSET C', 'IN ASSET C'):
-                            si_asset_col = col
-                    except (TypeError, AttributeError):
-                        continue
-                use_switch_columns = bool(in_broker_col and in_subfund_col and out_broker_col and out_subfund_col)
-                if use_switch_columns:
-                    loading_window.update_status("Using broker/subfund/asset from Switch Register (no RTA)...")
-                else:
-                    if not self.rta_master_path:
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Incomplete Upload",
-                            "Please upload RTA Master file, or use a Switch Register with columns: "
-                            "IN_BROKER, IN_SUBFUND, OUT_BROKER, OUT_SUBFUN (or OUT_SUBFUND), SO_ASSET_C, SI_ASSET_C (or IN_ASSET_C)."
-                        ))
-                        self.root.after(0, loading_window.stop)
-                        return
-                    loading_window.update_status("Reading RTA Master file...")
-                    if self.rta_master_path.endswith('.csv'):
-                        rta_df = pd.read_csv(self.rta_master_path)
-                    else:
-                        rta_df = pd.read_excel(self.rta_master_path)
-                    if rta_df.columns.duplicated().any():
-                        dupes = rta_df.columns[rta_df.columns.duplicated()].tolist()
-                        self.root.after(0, lambda: messagebox.showerror(
-                            "Error",
-                            f"RTA Master file has duplicate column names: {dupes}. Please fix the file and try again."
-                        ))
-                        self.root.after(0, loading_window.stop)
-                        return
-                
-                loading_window.update_status("Reading Brokerage Structure file(s)...")
-                # Read all Brokerage Structure files
-                brokerage_dfs = []
-                for file_path in self.brokerage_structure_paths:
-                    if file_path.endswith('.csv'):
-                        df = pd.read_csv(file_path)
-                    else:
-                        df = pd.read_excel(file_path)
-                    
-                    # Check for duplicate columns
-                    if df.columns.duplicated().any():
-                        dupes = df.columns[df.columns.duplicated()].tolist()
-                        self.root.after(0, lambda d=dupes, f=os.path.basename(file_path): messagebox.showerror(
-                            "Error",
-                            f"Brokerage Structure file '{f}' has duplicate column names: {d}. Please fix the file and try again."
-                        ))
-                        self.root.after(0, loading_window.stop)
-                        return
-                    
-                    brokerage_dfs.append(df)
-                
-                # Combine all brokerage structure files
-                if len(brokerage_dfs) > 1:
-                    combined_brokerage_df = pd.concat(brokerage_dfs, ignore_index=True)
-                else:
-                    combined_brokerage_df = brokerage_dfs[0] if brokerage_dfs else pd.DataFrame()
-                
-                loading_window.update_status("Processing Switch Register data...")
-                
-                processed_df = switch_df.copy()
-                
-                if use_switch_columns:
-                    # Use IN/OUT broker, subfund, and asset columns directly from Switch Register (no RTA)
-                    processed_df['IN subfund code'] = processed_df[in_subfund_col].astype(str).str.strip()
-                    processed_df['out subfund code'] = processed_df[out_subfund_col].astype(str).str.strip()
-                    if si_asset_col:
-                        processed_df['IN ASSET_CLASS'] = processed_df[si_asset_col].fillna('Not Found').astype(str).str.strip()
-                    else:
-                        processed_df['IN ASSET_CLASS'] = 'Not Found'
-                    if so_asset_col:
-                        processed_df['out ASSET_CLASS'] = processed_df[so_asset_col].fillna('Not Found').astype(str).str.strip()
-                    else:
-                        processed_df['out ASSET_CLASS'] = 'Not Found'
-                else:
-                    # Process Switch Register: Extract scheme codes from "From" and "Scheme :" columns, then RTA
-                    # Function to extract scheme code (part before "/")
-                    def extract_scheme_code(value):
-                        if pd.isna(value):
-                            return None
-                        value_str = str(value)
-                        if '/' in value_str:
-                            scheme_code = value_str.split('/')[0].strip()
-                            return scheme_code
-                        return None
-                    
-                    # Find "From" column (case-insensitive)
-                    from_col = None
-                    for col in processed_df.columns:
-                        if str(col).upper().strip() == 'FROM':
-                            from_col = col
-                            break
-                    
-                    # Find "Scheme :" column (case-insensitive, handle variations)
-                    scheme_col = None
-                    for col in processed_df.columns:
-                        col_upper = str(col).upper().strip()
-                        if col_upper == 'SCHEME :' or col_upper == 'SCHEME:' or col_upper == 'SCHEME':
-                            scheme_col = col
-                            break
-                    
-                    # Process "From" column
-                    if from_col:
-                        # Extract scheme code and add as "out Scheme Code" at the start
-                        out_scheme_codes = processed_df[from_col].apply(extract_scheme_code)
-                        processed_df.insert(0, 'out Scheme Code', out_scheme_codes)
-                        
-                        # Rename "From" column to "switch out scheme"
-                        processed_df = processed_df.rename(columns={from_col: 'switch out scheme'})
-                    else:
-                        # If "From" column not found, show warning but continue
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Warning",
-                            "From column not found in Switch Register. Processing without out scheme code extraction."
-                        ))
-                        # Add empty column
-                        processed_df.insert(0, 'out Scheme Code', None)
-                    
-                    # Process "Scheme :" column
-                    if scheme_col:
-                        # Extract scheme code and add as "IN Scheme Code" after "out Scheme Code"
-                        in_scheme_codes = processed_df[scheme_col].apply(extract_scheme_code)
-                        # Find position after "out Scheme Code"
-                        out_scheme_code_idx = list(processed_df.columns).index('out Scheme Code')
-                        processed_df.insert(out_scheme_code_idx + 1, 'IN Scheme Code', in_scheme_codes)
-                        
-                        # Rename "Scheme :" column to "switch in scheme"
-                        processed_df = processed_df.rename(columns={scheme_col: 'switch in scheme'})
-                    else:
-                        # If "Scheme :" column not found, show warning but continue
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Warning",
-                            "Scheme : column not found in Switch Register. Processing without IN scheme code extraction."
-                        ))
-                        # Add empty column after "out Scheme Code"
-                        out_scheme_code_idx = list(processed_df.columns).index('out Scheme Code')
-                        processed_df.insert(out_scheme_code_idx + 1, 'IN Scheme Code', None)
-                    
-                    loading_window.update_status("Matching scheme codes with RTA Master...")
-                    
-                    # Find Scheme_code, PARENT_SUB_FUND_CODE, and ASSET_CLASS columns in RTA Master
-                    scheme_code_col = None
-                    parent_sub_fund_code_col = None
-                    asset_class_col = None
-                    
-                    for col in rta_df.columns:
-                        try:
-                            col_upper = str(col).upper().strip()
-                            if col_upper == 'SCHEME_CODE' or col_upper == 'SCHEME CODE':
-                                scheme_code_col = col
-                            elif col_upper == 'PARENT_SUB_FUND_CODE' or col_upper == 'PARENT SUB FUND CODE':
-                                parent_sub_fund_code_col = col
-                            elif col_upper == 'ASSET_CLASS' or col_upper == 'ASSET CLASS' or ('ASSET' in col_upper and 'CLASS' in col_upper):
-                                asset_class_col = col
-                        except (TypeError, AttributeError):
-                            # Skip columns that can't be converted to string or checked
-                            continue
-                    
-                    if scheme_code_col and parent_sub_fund_code_col:
-                        # Normalize RTA Master columns for matching
-                        rta_df_normalized = rta_df.copy()
-                        rta_df_normalized[scheme_code_col] = rta_df_normalized[scheme_code_col].astype(str).str.strip()
-                        rta_df_normalized[parent_sub_fund_code_col] = rta_df_normalized[parent_sub_fund_code_col].astype(str).str.strip()
-                        
-                        # Create mapping: Scheme_code -> PARENT_SUB_FUND_CODE
-                        subfund_mapping = rta_df_normalized.set_index(scheme_code_col)[parent_sub_fund_code_col].to_dict()
-                        
-                        # Create mapping: Scheme_code -> ASSET_CLASS (if column exists)
-                        asset_class_mapping = {}
-                        if asset_class_col:
-                            rta_df_normalized[asset_class_col] = rta_df_normalized[asset_class_col].astype(str).str.strip()
-                            asset_class_mapping = rta_df_normalized.set_index(scheme_code_col)[asset_class_col].to_dict()
-                        
-                        # Match "out Scheme Code" with Scheme_code and get PARENT_SUB_FUND_CODE
-                        if 'out Scheme Code' in processed_df.columns:
-                            processed_df['out Scheme Code'] = processed_df['out Scheme Code'].astype(str).str.strip()
-                            processed_df['out subfund code'] = processed_df['out Scheme Code'].map(subfund_mapping)
-                            processed_df['out subfund code'] = processed_df['out subfund code'].fillna('Not Found')
-                            
-                            # Get ASSET_CLASS for "out Scheme Code"
-                            if asset_class_mapping:
-                                processed_df['out ASSET_CLASS'] = processed_df['out Scheme Code'].map(asset_class_mapping)
-                                processed_df['out ASSET_CLASS'] = processed_df['out ASSET_CLASS'].fillna('Not Found')
-                            else:
-                                processed_df['out ASSET_CLASS'] = 'Not Found'
-                            
-                            # Insert "out subfund code" right after "out Scheme Code"
-                            cols = list(processed_df.columns)
-                            out_scheme_idx = cols.index('out Scheme Code')
-                            out_subfund = processed_df.pop('out subfund code')
-                            out_asset_class = processed_df.pop('out ASSET_CLASS')
-                            processed_df.insert(out_scheme_idx + 1, 'out subfund code', out_subfund)
-                            processed_df.insert(out_scheme_idx + 2, 'out ASSET_CLASS', out_asset_class)
-                        else:
-                            processed_df['out subfund code'] = 'Not Found'
-                            processed_df['out ASSET_CLASS'] = 'Not Found'
-                        
-                        # Match "IN Scheme Code" with Scheme_code and get PARENT_SUB_FUND_CODE
-                        if 'IN Scheme Code' in processed_df.columns:
-                            processed_df['IN Scheme Code'] = processed_df['IN Scheme Code'].astype(str).str.strip()
-                            processed_df['IN subfund code'] = processed_df['IN Scheme Code'].map(subfund_mapping)
-                            processed_df['IN subfund code'] = processed_df['IN subfund code'].fillna('Not Found')
-                            
-                            if asset_class_mapping:
-                                processed_df['IN ASSET_CLASS'] = processed_df['IN Scheme Code'].map(asset_class_mapping)
-                                processed_df['IN ASSET_CLASS'] = processed_df['IN ASSET_CLASS'].fillna('Not Found')
-                            else:
-                                processed_df['IN ASSET_CLASS'] = 'Not Found'
-                            
-                            cols = list(processed_df.columns)
-                            in_scheme_idx = cols.index('IN Scheme Code')
-                            in_subfund = processed_df.pop('IN subfund code')
-                            in_asset_class = processed_df.pop('IN ASSET_CLASS')
-                            processed_df.insert(in_scheme_idx + 1, 'IN subfund code', in_subfund)
-                            processed_df.insert(in_scheme_idx + 2, 'IN ASSET_CLASS', in_asset_class)
-                        else:
-                            processed_df['IN subfund code'] = 'Not Found'
-                            processed_df['IN ASSET_CLASS'] = 'Not Found'
-                    else:
-                        missing_cols = []
-                        if not scheme_code_col:
-                            missing_cols.append("Scheme_code")
-                        if not parent_sub_fund_code_col:
-                            missing_cols.append("PARENT_SUB_FUND_CODE")
-                        
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Warning",
-                            f"Columns not found in RTA Master: {', '.join(missing_cols)}\n"
-                            f"Subfund codes and ASSET_CLASS will not be added."
-                        ))
-                        processed_df['out subfund code'] = 'Not Found'
-                        processed_df['out ASSET_CLASS'] = 'Not Found'
-                        processed_df['IN subfund code'] = 'Not Found'
-                        processed_df['IN ASSET_CLASS'] = 'Not Found'
-                
-                loading_window.update_status("Matching with Brokerage Structure...")
-                
-                # Match broker and IN subfund code with Brokerage Structure
-                if not combined_brokerage_df.empty:
-                    # DEBUG: Print Brokerage Structure columns
-                    print("\n=== DEBUG: Brokerage Structure Columns ===")
-                    print(list(combined_brokerage_df.columns))
-                    print(f"Total rows: {len(combined_brokerage_df)}")
-                    if len(combined_brokerage_df) > 0:
-                        print("\nFirst few rows:")
-                        print(combined_brokerage_df.head(3))
-                    
-                    # Find columns in Brokerage Structure
-                    cons_code_col = None
-                    scheme_code_b_col = None
-                    trail_rate_cols = {}
-                    investment_period_from_col = None
-                    investment_period_to_col = None
-                    
-                    for col in combined_brokerage_df.columns:
-                        try:
-                            col_upper = str(col).upper().strip()
-                            # More flexible matching for Cons Code
-                            if 'CONS' in col_upper and 'CODE' in col_upper:
-                                cons_code_col = col
-                            elif col_upper == 'CONS_CODE' or col_upper == 'CONS':
-                                cons_code_col = col
-                            # More flexible matching for Scheme Code
-                            elif 'SCHEME' in col_upper and 'CODE' in col_upper:
-                                scheme_code_b_col = col
-                            elif col_upper == 'SCHEME_CODE' or (col_upper == 'SCHEME' and scheme_code_b_col is None):
-                                scheme_code_b_col = col
-                            # Investment Period From
-                            elif 'INVESTMENT' in col_upper and 'PERIOD' in col_upper and 'FROM' in col_upper:
-                                investment_period_from_col = col
-                            # Investment Period To
-                            elif 'INVESTMENT' in col_upper and 'PERIOD' in col_upper and 'TO' in col_upper:
-                                investment_period_to_col = col
-                            # Trail Rate columns
-                            elif 'TRAIL' in col_upper and '1' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
-                                trail_rate_cols[1] = col
-                            elif 'TRAIL' in col_upper and '2' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
-                                trail_rate_cols[2] = col
-                            elif 'TRAIL' in col_upper and '3' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
-                                trail_rate_cols[3] = col
-                            elif 'TRAIL' in col_upper and '4' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
-                                trail_rate_cols[4] = col
-                            elif 'TRAIL' in col_upper and '5' in col_upper and ('YEAR' in col_upper or 'YR' in col_upper):
-                                trail_rate_cols[5] = col
-                        except (TypeError, AttributeError):
-                            # Skip columns that can't be converted to string or checked
-                            continue
-                    
-                    # DEBUG: Print found columns
-                    print(f"\n=== DEBUG: Found Columns ===")
-                    print(f"Cons Code Column: {cons_code_col}")
-                    print(f"Scheme Code Column: {scheme_code_b_col}")
-                    print(f"Investment Period From Column: {investment_period_from_col}")
-                    print(f"Investment Period To Column: {investment_period_to_col}")
-                    print(f"Trail Rate Columns: {trail_rate_cols}")
-                    
-                    # Find broker column in Switch Register (flexible matching); use IN/OUT broker when available
-                    broker_col = None
-                    for col in processed_df.columns:
-                        col_upper = str(col).upper().strip()
-                        if 'BROK' in col_upper and ('DLR' in col_upper or 'DEALER' in col_upper):
-                            broker_col = col
-                            break
-                        elif col_upper == 'BROKER' or col_upper == 'BROKER CODE' or col_upper == 'BROKER_CODE':
-                            broker_col = col
-                            break
-                    if use_switch_columns:
-                        broker_col = in_broker_col  # for switch-in trail matching
-                        broker_col_out = out_broker_col  # for switch-out trail matching
-                    else:
-                        broker_col_out = broker_col
-                    
-                    print(f"Broker Column in Switch Register: {broker_col}")
-                    print(f"Switch Register Columns: {list(processed_df.columns)}")
-                    
-                    # Find transaction date column in Switch Register (prefer OUT_TRADE_ from Switch Register)
-                    tran_date_col = None
-                    for col in processed_df.columns:
-                        col_upper = str(col).upper().strip()
-                        if col_upper in ('OUT_TRADE_', 'OUT_TRADE', 'OUT TRADE'):
-                            tran_date_col = col
-                            break
-                        elif 'TRAN' in col_upper and 'DATE' in col_upper:
-                            tran_date_col = col
-                            break
-                        elif col_upper == 'TRANSACTION DATE' or col_upper == 'TRANSACTION_DATE':
-                            tran_date_col = col
-                            break
-                        elif col_upper == 'DATE':
-                            tran_date_col = col
-                            break
-                    
-                    print(f"Transaction Date Column: {tran_date_col}")
-                    
-                    if cons_code_col and scheme_code_b_col and broker_col:
-                        # Normalize Brokerage Structure for matching
-                        brokerage_normalized = combined_brokerage_df.copy()
-                        brokerage_normalized[cons_code_col] = brokerage_normalized[cons_code_col].astype(str).str.strip().str.upper()
-                        brokerage_normalized[scheme_code_b_col] = brokerage_normalized[scheme_code_b_col].astype(str).str.strip().str.upper()
-                        
-                        # Remove NaN values that might cause issues
-                        brokerage_normalized = brokerage_normalized[
-                            (brokerage_normalized[cons_code_col] != 'NAN') &
-                            (brokerage_normalized[cons_code_col] != '') &
-                            (brokerage_normalized[scheme_code_b_col] != 'NAN') &
-                            (brokerage_normalized[scheme_code_b_col] != '')
-                        ]
-                        
-                        # Convert Investment Period dates to datetime if columns exist
-                        if investment_period_from_col and investment_period_from_col in brokerage_normalized.columns:
-                            brokerage_normalized['_PERIOD_FROM_DT'] = pd.to_datetime(
-                                brokerage_normalized[investment_period_from_col], 
-                                errors='coerce',
-                                dayfirst=True
-                            )
-                        else:
-                            brokerage_normalized['_PERIOD_FROM_DT'] = pd.NaT
-                        
-                        if investment_period_to_col and investment_period_to_col in brokerage_normalized.columns:
-                            brokerage_normalized['_PERIOD_TO_DT'] = pd.to_datetime(
-                                brokerage_normalized[investment_period_to_col], 
-                                errors='coerce',
-                                dayfirst=True
-                            )
-                        else:
-                            brokerage_normalized['_PERIOD_TO_DT'] = pd.NaT
-                        
-                        # Convert transaction date in processed_df if column exists
-                        if tran_date_col and tran_date_col in processed_df.columns:
-                            processed_df['_TRAN_DATE_DT'] = pd.to_datetime(
-                                processed_df[tran_date_col], 
-                                errors='coerce',
-                                dayfirst=True
-                            )
-                        else:
-                            processed_df['_TRAN_DATE_DT'] = pd.NaT
-                        
-                        # Build lookup: (broker, scheme) -> subset of brokerage for fast per-row access
-                        brokerage_lookup = {}
-                        for (b, s), grp in brokerage_normalized.groupby([cons_code_col, scheme_code_b_col], dropna=False):
-                            try:
-                                k = (str(b).strip().upper() if pd.notna(b) else '', str(s).strip().upper() if pd.notna(s) else '')
-                                if k[0] != '' and k[1] != '':
-                                    brokerage_lookup[k] = grp
-                            except (TypeError, AttributeError):
-                                pass
-                        empty_df = pd.DataFrame()
-                        
-                        # DEBUG: Print sample values
-                        print(f"\n=== DEBUG: Sample Brokerage Values ===")
-                        if len(brokerage_normalized) > 0:
-                            print(f"Sample Cons Code values: {brokerage_normalized[cons_code_col].head(5).tolist()}")
-                            print(f"Sample Scheme Code values: {brokerage_normalized[scheme_code_b_col].head(5).tolist()}")
-                            if investment_period_from_col:
-                                print(f"Sample Period From values: {brokerage_normalized[investment_period_from_col].head(3).tolist()}")
-                            if investment_period_to_col:
-                                print(f"Sample Period To values: {brokerage_normalized[investment_period_to_col].head(3).tolist()}")
-                        
-                        # Create a function to get trail rates
-                        match_count = 0
-                        no_match_count = 0
-                        
-                        def get_trail_rates_and_periods(row):
-                            nonlocal match_count, no_match_count
-                            try:
-                                # Get broker code
-                                broker = row.get(broker_col) if broker_col in row.index else None
-                                if pd.isna(broker) or broker == '':
-                                    no_match_count += 1
-                                    return ['Not Found'] * 3  # 1 trail rate + 2 period columns
-                                
-                                broker_str = str(broker).strip().upper()
-                                
-                                # Get IN subfund code
-                                in_subfund = row.get('IN subfund code') if 'IN subfund code' in row.index else None
-                                if pd.isna(in_subfund) or in_subfund == 'Not Found' or in_subfund == '':
-                                    no_match_count += 1
-                                    return ['Not Found'] * 3
-                                
-                                in_subfund_str = str(in_subfund).strip().upper()
-                                
-                                # Get transaction date
-                                tran_date = row.get('_TRAN_DATE_DT') if '_TRAN_DATE_DT' in row.index else None
-                                
-                                # Calculate previous month from transaction date
-                                previous_month_date = None
-                                if pd.notna(tran_date):
-                                    try:
-                                        # Get the first day of the transaction month
-                                        first_day_current = tran_date.replace(day=1)
-                                        # Subtract one day to get last day of previous month
-                                        last_day_previous = first_day_current - pd.Timedelta(days=1)
-                                        # Get first day of previous month
-                                        previous_month_date = last_day_previous.replace(day=1)
-                                    except Exception:
-                                        previous_month_date = None
-                                
-                                # DEBUG: Print first few attempts only (avoid I/O slowdown)
-                                if match_count + no_match_count < 2:
-                                    print(f"\n=== DEBUG: Matching Attempt {match_count + no_match_count + 1} ===")
-                                    print(f"Broker: '{broker_str}'")
-                                    print(f"IN Subfund: '{in_subfund_str}'")
-                                    print(f"Transaction Date: {tran_date}")
-                                    print(f"Previous Month Date: {previous_month_date}")
-                                
-                                # Look up brokerage rows for this (broker, scheme) — O(1) instead of full scan
-                                matches = brokerage_lookup.get((broker_str, in_subfund_str), empty_df)
-                                
-                                if matches.empty:
-                                    no_match_count += 1
-                                    if match_count + no_match_count <= 2:
-                                        print(f"  No match for (broker, IN subfund)")
-                                    return ['Not Found'] * 4  # 1 current + 1 previous trail rate + 2 period columns
-                                
-                                # Vectorized date match: find row(s) where tran_date in [period_from, period_to]
-                                current_rate_match = None
-                                previous_rate_match = None
-                                pf = matches['_PERIOD_FROM_DT']
-                                pt = matches['_PERIOD_TO_DT']
-                                has_period = pf.notna() & pt.notna()
-                                
-                                if pd.notna(tran_date) and investment_period_from_col and investment_period_to_col and has_period.any():
-                                    # Current: first row where period contains tran_date
-                                    in_range_cur = (pf <= tran_date) & (tran_date <= pt)
-                                    if in_range_cur.any():
-                                        current_rate_match = matches.loc[in_range_cur].iloc[0]
-                                        if match_count + no_match_count < 2:
-                                            print(f"  ✓ Current month match found!")
-                                    
-                                    # Previous month (same year): first row where period contains previous_month_date
-                                    if previous_month_date and pd.notna(previous_month_date) and previous_month_date.year == tran_date.year:
-                                        in_range_prev = (pf <= previous_month_date) & (previous_month_date <= pt)
-                                        if in_range_prev.any():
-                                            previous_rate_match = matches.loc[in_range_prev].iloc[0]
-                                            if match_count + no_match_count < 2:
-                                                print(f"  ✓ Previous month match found! (same year)")
-                                else:
-                                    # No date filtering - use first match for current only
-                                    if not matches.empty:
-                                        current_rate_match = matches.iloc[0]
-                                        if match_count + no_match_count < 2:
-                                            print(f"  ⚠ Using first match (no date filter)")
-                                
-                                match_count += 1
-                                if match_count <= 2:
-                                    print(f"  ✓ Match found!")
-                                
-                                results = []
-                                
-                                # Get Trail Rate 1 year for CURRENT month
-                                if current_rate_match is not None and 1 in trail_rate_cols:
-                                    trail_col = trail_rate_cols[1]
-                                    if trail_col in current_rate_match.index:
-                                        rate_value = current_rate_match[trail_col]
-                                        if pd.notna(rate_value) and str(rate_value).strip() != '':
-                                            results.append(rate_value)
-                                        else:
-                                            results.append('Not Found')
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                # Get Trail Rate 1 year for PREVIOUS month
-                                if previous_rate_match is not None and 1 in trail_rate_cols:
-                                    trail_col = trail_rate_cols[1]
-                                    if trail_col in previous_rate_match.index:
-                                        rate_value = previous_rate_match[trail_col]
-                                        if pd.notna(rate_value) and str(rate_value).strip() != '':
-                                            results.append(rate_value)
-                                        else:
-                                            results.append('Not Found')
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                # Get Investment Period From (from current match)
-                                if current_rate_match is not None and investment_period_from_col and investment_period_from_col in current_rate_match.index:
-                                    period_from = current_rate_match[investment_period_from_col]
-                                    if pd.notna(period_from) and str(period_from).strip() != '':
-                                        results.append(period_from)
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                # Get Investment Period To (from current match)
-                                if current_rate_match is not None and investment_period_to_col and investment_period_to_col in current_rate_match.index:
-                                    period_to = current_rate_match[investment_period_to_col]
-                                    if pd.notna(period_to) and str(period_to).strip() != '':
-                                        results.append(period_to)
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                return results
-                            except Exception as e:
-                                no_match_count += 1
-                                if match_count + no_match_count <= 2:
-                                    print(f"  Exception: {str(e)}")
-                                return ['Not Found'] * 4
-                        
-                        # Apply trail rate and period extraction
-                        trail_results = processed_df.apply(get_trail_rates_and_periods, axis=1, result_type='expand')
-                        trail_results.columns = ['switch in Trail Rate 1 year', 'PREVIOUS switch in Trail Rate 1 year', 'Investment Period From', 'Investment Period To']
-                        
-                        # Add trail rate columns to processed_df
-                        processed_df['switch in Trail Rate 1 year'] = trail_results['switch in Trail Rate 1 year']
-                        processed_df['PREVIOUS switch in Trail Rate 1 year'] = trail_results['PREVIOUS switch in Trail Rate 1 year']
-                        
-                        # Add Investment Period columns
-                        processed_df['Investment Period From'] = trail_results['Investment Period From']
-                        processed_df['Investment Period To'] = trail_results['Investment Period To']
-                        
-                        # DEBUG: Print summary
-                        print(f"\n=== DEBUG: Matching Summary (IN) ===")
-                        print(f"Total matches: {match_count}")
-                        print(f"Total no matches: {no_match_count}")
-                        print(f"Total rows processed: {len(processed_df)}")
-                        
-                        # Now match with OUT subfund code for "switch out" trail rates
-                        loading_window.update_status("Matching with Brokerage Structure (OUT)...")
-                        
-                        match_count_out = 0
-                        no_match_count_out = 0
-                        
-                        def get_trail_rates_out(row):
-                            nonlocal match_count_out, no_match_count_out
-                            try:
-                                # Get broker code (OUT broker when use_switch_columns)
-                                broker = row.get(broker_col_out) if broker_col_out in row.index else None
-                                if pd.isna(broker) or broker == '':
-                                    no_match_count_out += 1
-                                    return ['Not Found']  # 1 trail rate only
-                                
-                                broker_str = str(broker).strip().upper()
-                                
-                                # Get OUT subfund code
-                                out_subfund = row.get('out subfund code') if 'out subfund code' in row.index else None
-                                if pd.isna(out_subfund) or out_subfund == 'Not Found' or out_subfund == '':
-                                    no_match_count_out += 1
-                                    return ['Not Found']
-                                
-                                out_subfund_str = str(out_subfund).strip().upper()
-                                
-                                # Get transaction date
-                                tran_date = row.get('_TRAN_DATE_DT') if '_TRAN_DATE_DT' in row.index else None
-                                
-                                # Calculate previous month from transaction date
-                                previous_month_date = None
-                                if pd.notna(tran_date):
-                                    try:
-                                        # Get the first day of the transaction month
-                                        first_day_current = tran_date.replace(day=1)
-                                        # Subtract one day to get last day of previous month
-                                        last_day_previous = first_day_current - pd.Timedelta(days=1)
-                                        # Get first day of previous month
-                                        previous_month_date = last_day_previous.replace(day=1)
-                                    except Exception:
-                                        previous_month_date = None
-                                
-                                # Look up brokerage rows for this (broker, scheme) — O(1) instead of full scan
-                                matches = brokerage_lookup.get((broker_str, out_subfund_str), empty_df)
-                                
-                                if matches.empty:
-                                    no_match_count_out += 1
-                                    return ['Not Found', 'Not Found']  # Current + Previous
-                                
-                                current_rate_match = None
-                                previous_rate_match = None
-                                # Vectorized date match (same as IN)
-                                pf = matches['_PERIOD_FROM_DT']
-                                pt = matches['_PERIOD_TO_DT']
-                                has_period = pf.notna() & pt.notna()
-                                
-                                if pd.notna(tran_date) and investment_period_from_col and investment_period_to_col and has_period.any():
-                                    in_range_cur = (pf <= tran_date) & (tran_date <= pt)
-                                    if in_range_cur.any():
-                                        current_rate_match = matches.loc[in_range_cur].iloc[0]
-                                    if previous_month_date and pd.notna(previous_month_date) and previous_month_date.year == tran_date.year:
-                                        in_range_prev = (pf <= previous_month_date) & (previous_month_date <= pt)
-                                        if in_range_prev.any():
-                                            previous_rate_match = matches.loc[in_range_prev].iloc[0]
-                                else:
-                                    if not matches.empty:
-                                        current_rate_match = matches.iloc[0]
-                                
-                                match_count_out += 1
-                                
-                                results = []
-                                
-                                # Get Trail Rate 1 year for CURRENT month
-                                if current_rate_match is not None and 1 in trail_rate_cols:
-                                    trail_col = trail_rate_cols[1]
-                                    if trail_col in current_rate_match.index:
-                                        rate_value = current_rate_match[trail_col]
-                                        if pd.notna(rate_value) and str(rate_value).strip() != '':
-                                            results.append(rate_value)
-                                        else:
-                                            results.append('Not Found')
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                # Get Trail Rate 1 year for PREVIOUS month
-                                if previous_rate_match is not None and 1 in trail_rate_cols:
-                                    trail_col = trail_rate_cols[1]
-                                    if trail_col in previous_rate_match.index:
-                                        rate_value = previous_rate_match[trail_col]
-                                        if pd.notna(rate_value) and str(rate_value).strip() != '':
-                                            results.append(rate_value)
-                                        else:
-                                            results.append('Not Found')
-                                    else:
-                                        results.append('Not Found')
-                                else:
-                                    results.append('Not Found')
-                                
-                                return results
-                            except Exception as e:
-                                no_match_count_out += 1
-                                return ['Not Found', 'Not Found']
-                        
-                        # Apply trail rate extraction for OUT subfund code
-                        trail_results_out = processed_df.apply(get_trail_rates_out, axis=1, result_type='expand')
-                        trail_results_out.columns = ['switch out Trail Rate 1 year', 'PREVIOUS switch out Trail Rate 1 year']
-                        
-                        # Add "switch out" trail rate columns to processed_df
-                        processed_df['switch out Trail Rate 1 year'] = trail_results_out['switch out Trail Rate 1 year']
-                        processed_df['PREVIOUS switch out Trail Rate 1 year'] = trail_results_out['PREVIOUS switch out Trail Rate 1 year']
-                        
-                        # DEBUG: Print summary for OUT
-                        print(f"\n=== DEBUG: Matching Summary (OUT) ===")
-                        print(f"Total matches: {match_count_out}")
-                        print(f"Total no matches: {no_match_count_out}")
-                        
-                        # Add check columns: if switch in > switch out, show "Check"
-                        loading_window.update_status("Calculating checks...")
-                        
-                        def compare_trail_rates(value_in, value_out):
-                            """Compare two trail rate values and return 'Check' if in > out"""
-                            try:
-                                # Handle "Not Found" or empty values
-                                if pd.isna(value_in) or str(value_in).strip() == '' or str(value_in).strip().upper() == 'NOT FOUND':
-                                    return ''
-                                if pd.isna(value_out) or str(value_out).strip() == '' or str(value_out).strip().upper() == 'NOT FOUND':
-                                    return ''
-                                
-                                # Convert to numeric, handling percentage signs and other formats
-                                val_in_str = str(value_in).strip().replace('%', '').replace(',', '')
-                                val_out_str = str(value_out).strip().replace('%', '').replace(',', '')
-                                
-                                try:
-                                    val_in_num = float(val_in_str)
-                                    val_out_num = float(val_out_str)
-                                    
-                                    # If switch in > switch out, return "Check"
-                                    if val_in_num > val_out_num:
-                                        return 'Check'
-                                    else:
-                                        return ''
-                                except (ValueError, TypeError):
-                                    # If conversion fails, return empty
-                                    return ''
-                            except Exception:
-                                return ''
-                        
-                        # Add check column for 1 year only
-                        col_in = 'switch in Trail Rate 1 year'
-                        col_out = 'switch out Trail Rate 1 year'
-                        check_col = 'Check 1 year'
-                        
-                        if col_in in processed_df.columns and col_out in processed_df.columns:
-                            processed_df[check_col] = processed_df.apply(
-                                lambda row: compare_trail_rates(row[col_in], row[col_out]),
-                                axis=1
-                            )
-                        else:
-                            processed_df[check_col] = ''
-                        
-                        # Add check: PREVIOUS switch in Trail Rate 1 year < switch in Trail Rate 1 year
-                        loading_window.update_status("Calculating previous vs current check...")
-                        
-                        def compare_previous_vs_current(previous_value, current_value):
-                            """Compare previous and current trail rate values and return 'Check' if previous < current"""
-                            try:
-                                # Handle "Not Found" or empty values
-                                if pd.isna(previous_value) or str(previous_value).strip() == '' or str(previous_value).strip().upper() == 'NOT FOUND':
-                                    return ''
-                                if pd.isna(current_value) or str(current_value).strip() == '' or str(current_value).strip().upper() == 'NOT FOUND':
-                                    return ''
-                                
-                                # Convert to numeric, handling percentage signs and other formats
-                                prev_str = str(previous_value).strip().replace('%', '').replace(',', '')
-                                curr_str = str(current_value).strip().replace('%', '').replace(',', '')
-                                
-                                try:
-                                    prev_num = float(prev_str)
-                                    curr_num = float(curr_str)
-                                    
-                                    # If previous < current, return "Check"
-                                    if prev_num < curr_num:
-                                        return 'Check'
-                                    else:
-                                        return ''
-                                except (ValueError, TypeError):
-                                    # If conversion fails, return empty
-                                    return ''
-                            except Exception:
-                                return ''
-                        
-                        # Add check column for previous vs current
-                        prev_col = 'PREVIOUS switch in Trail Rate 1 year'
-                        curr_col = 'switch in Trail Rate 1 year'
-                        prev_check_col = 'PREVIOUS switch in Trail Rate 1 year Check'
-                        
-                        if prev_col in processed_df.columns and curr_col in processed_df.columns:
-                            processed_df[prev_check_col] = processed_df.apply(
-                                lambda row: compare_previous_vs_current(row[prev_col], row[curr_col]),
-                                axis=1
-                            )
-                        else:
-                            processed_df[prev_check_col] = ''
-                    else:
-                        # Missing required columns
-                        missing_cols = []
-                        if not cons_code_col:
-                            missing_cols.append("Cons Code")
-                        if not scheme_code_b_col:
-                            missing_cols.append("Scheme Code")
-                        if not broker_col:
-                            missing_cols.append("Broker Column (BROK_DLR_N or similar)")
-                        
-                        self.root.after(0, lambda m=missing_cols: messagebox.showwarning(
-                            "Warning",
-                            f"Columns not found:\n"
-                            f"Brokerage Structure: {', '.join([c for c in m if c != 'Broker Column (BROK_DLR_N or similar)'])}\n"
-                            f"Switch Register: {', '.join([c for c in m if c == 'Broker Column (BROK_DLR_N or similar)'])}\n"
-                            f"Trail rates will not be added."
-                        ))
-                        # Add empty trail rate columns
-                        processed_df['switch in Trail Rate 1 year'] = 'Not Found'
-                        processed_df['PREVIOUS switch in Trail Rate 1 year'] = 'Not Found'
-                        processed_df['switch out Trail Rate 1 year'] = 'Not Found'
-                        processed_df['PREVIOUS switch out Trail Rate 1 year'] = 'Not Found'
-                        processed_df['Check 1 year'] = ''
-                        processed_df['PREVIOUS switch in Trail Rate 1 year Check'] = ''
-                        processed_df['Investment Period From'] = 'Not Found'
-                        processed_df['Investment Period To'] = 'Not Found'
-                else:
-                    # No brokerage structure data
-                    processed_df['switch in Trail Rate 1 year'] = 'Not Found'
-                    processed_df['PREVIOUS switch in Trail Rate 1 year'] = 'Not Found'
-                    processed_df['switch out Trail Rate 1 year'] = 'Not Found'
-                    processed_df['PREVIOUS switch out Trail Rate 1 year'] = 'Not Found'
-                    processed_df['Check 1 year'] = ''
-                    processed_df['PREVIOUS switch in Trail Rate 1 year Check'] = ''
-                    processed_df['Investment Period From'] = 'Not Found'
-                    processed_df['Investment Period To'] = 'Not Found'
-                
-                # Reorder columns: Group by year (switch in, switch out, check for each year)
-                loading_window.update_status("Reordering columns...")
+                result = engine.run(self.switch_register_path, choose_output, notify=notify, run_stats=save_run_stats,
+                                    incremental=incremental)
                 
-                # Get all current columns
-                all_columns = list(processed_df.columns)
-                
-                # Find trail rate and check columns
-                switch_in_col = None
-                previous_switch_in_col = None
-                switch_out_col = None
-                previous_switch_out_col = None
-                check_col = None
-                prev_check_col = None
-                
-                for col in all_columns:
-                    try:
-                        # Ensure col is a string before using 'in' operator
-                        col_str = str(col) if not isinstance(col, str) else col
-                        
-                        if col_str == 'switch in Trail Rate 1 year':
-                            switch_in_col = col
-                        elif col_str == 'PREVIOUS switch in Trail Rate 1 year':
-                            previous_switch_in_col = col
-                        elif col_str == 'switch out Trail Rate 1 year':
-                            switch_out_col = col
-                        elif col_str == 'PREVIOUS switch out Trail Rate 1 year':
-                            previous_switch_out_col = col
-                        elif col_str == 'Check 1 year':
-                            check_col = col
-                        elif col_str == 'PREVIOUS switch in Trail Rate 1 year Check':
-                            prev_check_col = col
-                    except (TypeError, AttributeError):
-                        # Skip columns that can't be converted to string
-                        pass
-                
-                # Build new column order: switch in, previous switch in, previous check, switch out, previous switch out, check
-                new_column_order = []
-                
-                # Add other columns first (before trail rate columns)
-                for col in all_columns:
-                    if col not in [switch_in_col, previous_switch_in_col, switch_out_col, previous_switch_out_col, check_col, prev_check_col]:
-                        if col not in new_column_order:
-                            new_column_order.append(col)
-                
-                # Add trail rate columns in order: switch in, previous switch in, previous check, switch out, previous switch out, check
-                if switch_in_col:
-                    new_column_order.append(switch_in_col)
-                if previous_switch_in_col:
-                    new_column_order.append(previous_switch_in_col)
-                if prev_check_col:
-                    new_column_order.append(prev_check_col)
-                if switch_out_col:
-                    new_column_order.append(switch_out_col)
-                if previous_switch_out_col:
-                    new_column_order.append(previous_switch_out_col)
-                if check_col:
-                    new_column_order.append(check_col)
-                
-                # Reorder the dataframe
-                processed_df = processed_df[new_column_order]
-                
-                # Add check for Regular vs Direct scheme matching
-                loading_window.update_status("Checking Regular vs Direct scheme matches...")
-                
-                # Find switch in/out scheme columns (IN_SCHEME_, OUT_SCHEM0/OUT_SCHEME or legacy)
-                def _norm_col(s):
-                    try:
-                        t = str(s).upper().lstrip('\ufeff').strip()
-                        return ' '.join(t.split()).replace(' ', '_')
-                    except (TypeError, AttributeError):
-                        return ''
-                in_scheme_col = None
-                out_scheme_col = None
-                for col in processed_df.columns:
-                    col_str = str(col).strip()
-                    c = _norm_col(col)
-                    # Exact match first (user's columns: IN_SCHEME_, OUT_SCHEM0)
-                    if col_str.upper() in ('IN_SCHEME_', 'IN_SCHEME'):
-                        in_scheme_col = col
-                    if col_str.upper() in ('OUT_SCHEM0', 'OUT_SCHEME'):
-                        out_scheme_col = col
-                if not in_scheme_col:
-                    for col in processed_df.columns:
-                        c = _norm_col(col)
-                        if 'IN_SCHEME' in c or c in ('IN_SCHEME_', 'INSCHEME', 'SCHEME_IN'):
-                            in_scheme_col = col
-                            break
-                if not out_scheme_col:
-                    for col in processed_df.columns:
-                        c = _norm_col(col)
-                        if 'OUT_SCHEM' in c or 'OUT_SCHEME' in c or c in ('OUTSCHEME', 'SCHEME_OUT'):
-                            out_scheme_col = col
-                            break
-                if not in_scheme_col and 'switch in scheme' in processed_df.columns:
-                    in_scheme_col = 'switch in scheme'
-                if not out_scheme_col and 'switch out scheme' in processed_df.columns:
-                    out_scheme_col = 'switch out scheme'
-                
-                def check_regular_direct_match(row):
-                    """Check if switch in and switch out schemes are the same but one is Regular and other is Direct"""
-                    try:
-                        switch_in = row.get(in_scheme_col) if in_scheme_col and in_scheme_col in row.index else None
-                        switch_out = row.get(out_scheme_col) if out_scheme_col and out_scheme_col in row.index else None
-                        
-                        if pd.isna(switch_in) or pd.isna(switch_out):
-                            return ''
-                        
-                        # Ensure we have strings
-                        try:
-                            switch_in_str = str(switch_in).strip() if switch_in is not None else ''
-                            switch_out_str = str(switch_out).strip() if switch_out is not None else ''
-                        except Exception:
-                            return ''
-                        
-                        if switch_in_str == '' or switch_out_str == '':
-                            return ''
-                        
-                        # Remove code prefix (e.g., "129B/ABSL" or any code before "/")
-                        def remove_code_prefix(scheme_str):
-                            try:
-                                scheme_str = str(scheme_str) if not isinstance(scheme_str, str) else scheme_str
-                                if '/' in scheme_str:
-                                    # Split by "/" and take everything after the first "/"
-                                    parts = scheme_str.split('/', 1)
-                                    if len(parts) > 1:
-                                        return parts[1].strip()
-                                return scheme_str
-                            except Exception:
-                                return str(scheme_str) if scheme_str is not None else ''
-                        
-                        scheme_in = remove_code_prefix(switch_in_str)
-                        scheme_out = remove_code_prefix(switch_out_str)
-                        
-                        if not scheme_in or not scheme_out:
-                            return ''
-                        
-                        # Normalize: remove Regular, Direct, Reg, Growth, Plan so "Regular" vs "Direct" don't hurt similarity
-                        def normalize_for_match(scheme):
-                            try:
-                                s = str(scheme).upper()
-                                for word in ['REGULAR GROWTH', 'REG GROWTH', 'REGULAR', 'REG PLAN', 'DIRECT GROWTH', 'DIRECT', 'REG', 'GROWTH', 'PLAN']:
-                                    s = s.replace(word, '')
-                                s = s.replace('-', ' ').replace('_', ' ').strip()
-                                while '  ' in s:
-                                    s = s.replace('  ', ' ')
-                                return s.strip()
-                            except Exception:
-                                return str(scheme) if scheme else ''
-                        
-                        norm_in = normalize_for_match(scheme_in)
-                        norm_out = normalize_for_match(scheme_out)
-                        if not norm_in and not norm_out:
-                            return ''
-                        if not norm_in or not norm_out:
-                            return ''
-                        # Exact match or fuzzy 80% on normalized base names
-                        if norm_in == norm_out:
-                            pass  # same scheme
-                        else:
-                            similarity = difflib.SequenceMatcher(None, norm_in, norm_out).ratio()
-                            if similarity < 0.75:
-                                return ''
-                        
-                        # Check if one has Regular and other has Direct
-                        try:
-                            switch_in_upper = str(switch_in_str).upper() if switch_in_str is not None else ''
-                            switch_out_upper = str(switch_out_str).upper() if switch_out_str is not None else ''
-                            if not isinstance(switch_in_upper, str) or not isinstance(switch_out_upper, str):
-                                return ''
-                            # Regular: REGULAR, REG GROWTH, REG PLAN, REG (with word boundary)
-                            has_regular_in = 'REGULAR' in switch_in_upper or 'REG GROWTH' in switch_in_upper or 'REG PLAN' in switch_in_upper or '-REG-' in switch_in_upper or ' REG ' in switch_in_upper
-                            has_regular_out = 'REGULAR' in switch_out_upper or 'REG GROWTH' in switch_out_upper or 'REG PLAN' in switch_out_upper or '-REG-' in switch_out_upper or ' REG ' in switch_out_upper
-                            # Direct
-                            has_direct_in = 'DIRECT' in switch_in_upper
-                            has_direct_out = 'DIRECT' in switch_out_upper
-                        except (TypeError, AttributeError):
-                            return ''
-                        # One Regular + one Direct = Check (e.g. -PLAN-Regular-Growth vs -PLAN-Direct-Growth)
-                        if (has_regular_in and has_direct_out) or (has_direct_in and has_regular_out):
-                            return 'Check'
-                        
-                        return ''
-                    except Exception as e:
-                        return ''
-                
-                # Add the check column
-                if in_scheme_col and out_scheme_col and in_scheme_col in processed_df.columns and out_scheme_col in processed_df.columns:
-                    processed_df['Regular vs Direct Check'] = processed_df.apply(check_regular_direct_match, axis=1)
-                else:
-                    processed_df['Regular vs Direct Check'] = ''
-                    if not in_scheme_col or not out_scheme_col:
-                        cols_found = [c for c in processed_df.columns if 'SCHEME' in str(c).upper() or 'SCHEM' in str(c).upper()]
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Regular vs Direct Check",
-                            f"Could not find scheme columns for Regular vs Direct check.\n"
-                            f"Looking for: IN_SCHEME_ (or IN_SCHEME), OUT_SCHEM0 (or OUT_SCHEME)\n"
-                            f"Columns with SCHEME in name: {cols_found[:10] if cols_found else 'None'}"
-                        ))
-                
-                loading_window.update_status("Processing complete...")
-                time.sleep(0.3)
-                
-                # Remove rows where broker is "DIRECT"
-                loading_window.update_status("Filtering out DIRECT broker entries...")
-                
-                # Find broker column for DIRECT filter (use OUT_BROKER when we have IN/OUT columns)
-                broker_col_filter = None
-                if use_switch_columns and out_broker_col and out_broker_col in processed_df.columns:
-                    broker_col_filter = out_broker_col
-                else:
-                    for col in processed_df.columns:
-                        col_upper = str(col).upper().strip()
-                        if 'BROK' in col_upper and ('DLR' in col_upper or 'DEALER' in col_upper):
-                            broker_col_filter = col
-                            break
-                        elif col_upper == 'BROKER' or col_upper == 'BROKER CODE' or col_upper == 'BROKER_CODE':
-                            broker_col_filter = col
-                            break
-                
-                if broker_col_filter and broker_col_filter in processed_df.columns:
-                    initial_count = len(processed_df)
-                    # Filter out rows where broker is "DIRECT" (case-insensitive)
-                    processed_df = processed_df[
-                        ~processed_df[broker_col_filter].astype(str).str.strip().str.upper().eq('DIRECT')
-                    ]
-                    removed_count = initial_count - len(processed_df)
-                    if removed_count > 0:
-                        print(f"\n=== Removed {removed_count} rows with DIRECT broker ===")
-                        self.root.after(0, lambda: messagebox.showinfo(
-                            "Filter Applied",
-                            f"Removed {removed_count} row(s) where broker is 'DIRECT'.\n"
-                            f"Remaining rows: {len(processed_df)}"
-                        ))
-                else:
-                    print("\n=== Warning: Broker column not found, skipping DIRECT filter ===")
-                
-                # Output only these columns, in this exact order
-                OUTPUT_COLUMNS = [
-                    'SL_NO', 'FOLIO_NO', 'INVESTOR_F', 'USER_TRXNN', 'OUT_TRXN_N',
-                    'SO_ASSET_C', 'OUT_SUBFUN', 'OUT_SCHEME', 'OUT_SCHEM0', 'OUT_TRADE_',
-                    'OUT_BROKER', 'OUT_BROKE1', 'SO_UNITS', 'SO_AMOUNT',
-                    'IN_SUBFUND', 'IN_SCHEME', 'IN_SCHEME_', 'SI_ASSET_C', 'IN_TRADE_D',
-                    'IN_BROKER', 'SI_UNITS', 'SI_AMOUNT',
-                    'IN ASSET_CLASS', 'out ASSET_CLASS',
-                    'Investment Period From', 'Investment Period To',
-                    'switch in Trail Rate 1 year', 'PREVIOUS switch in Trail Rate 1 year',
-                    'PREVIOUS switch in Trail Rate 1 year Check',
-                    'switch out Trail Rate 1 year', 'PREVIOUS switch out Trail Rate 1 year',
-                    'Check 1 year', 'Regular vs Direct Check'
-                ]
-                final_cols = []
-                for col in OUTPUT_COLUMNS:
-                    if col in processed_df.columns:
-                        final_cols.append(col)
-                    else:
-                        processed_df[col] = ''
-                        final_cols.append(col)
-                processed_df = processed_df[final_cols]
-                
-                loading_window.update_status("Preparing to save...")
-                save_path = filedialog.asksaveasfilename(
-                    title="Save Processed File",
-                    defaultextension=".xlsx",
-                    filetypes=[
-                        ("Excel files", "*.xlsx"),
-                        ("CSV files (faster for large files)", "*.csv"),
-                        ("All files", "*.*")
-                    ]
-                )
-                
-                if save_path:
-                    try:
-                        loading_window.update_status("Saving file...")
-                        # CSV: very fast even for millions of rows (recommended for large files)
-                        if save_path.lower().endswith('.csv'):
-                            processed_df.to_csv(save_path, index=False, encoding='utf-8-sig')
-                        else:
-                            # Excel: can be slow for 20k+ rows — use CSV for large files
-                            try:
-                                processed_df.to_excel(save_path, sheet_name='Processed Data', index=False, engine='xlsxwriter')
-                            except ImportError:
-                                processed_df.to_excel(save_path, sheet_name='Processed Data', index=False, engine='openpyxl')
-                        
-                        loading_window.update_status("Complete!")
-                        time.sleep(0.5)
-                        
-                        self.root.after(0, lambda: messagebox.showinfo(
-                            "Success",
-                            f"File processed and saved successfully at:\n{save_path}"
-                        ))
-                        self.root.after(0, lambda: self.status_label.configure(
-                            text="Processing completed successfully!",
-                            text_color="#27ae60"
-                        ))
-                    except Exception as e:
-                        self.root.after(0, lambda: messagebox.showerror(
-                            "Error",
-                            f"Could not save file:\n{e}"
-                        ))
-                        self.root.after(0, lambda: self.status_label.configure(
-                            text="Status: Could not save file!",
-                            text_color="#e74c3c"
-                        ))
-                else:
+                if result['output_path'] is None:
                     self.root.after(0, lambda: messagebox.showinfo(
                         "Cancelled",
                         "File save was cancelled."
@@ -1510,14 +2399,38 @@ class SwitchRegisterGUI:
                         text="Status: File save was cancelled.",
                         text_color="#f39c12"
                     ))
+                    return
+                
+                loading_window.update_status("Complete!")
+                time.sleep(0.5)
                 
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Success",
+                    f"File processed and saved successfully at:\n{result['output_path']}"
+                ))
+                self.root.after(0, lambda: self.status_label.configure(
+                    text="Processing completed successfully!",
+                    text_color="#27ae60"
+                ))
+                
+            except SwitchPipelineError as e:
+                # Bound now: the callbacks run after the except block has cleared e
+                self.root.after(0, lambda err=e: (
+                    messagebox.showwarning(err.title, err.message) if err.kind == 'warning'
+                    else messagebox.showerror(err.title, err.message)
+                ))
+                if e.status:
+                    self.root.after(0, lambda text=e.status: self.status_label.configure(
+                        text=text,
+                        text_color="#e74c3c"
+                    ))
             except Exception as e:
-                self.root.after(0, lambda: messagebox.showerror(
+                self.root.after(0, lambda err=str(e): messagebox.showerror(
                     "Error",
-                    f"Error processing files: {str(e)}"
+                    f"Error processing files: {err}"
                 ))
-                self.root.after(0, lambda: self.status_label.configure(
-                    text=f"Status: Error processing files: {str(e)}",
+                self.root.after(0, lambda err=str(e): self.status_label.configure(
+                    text=f"Status: Error processing files: {err}",
                     text_color="#e74c3c"
                 ))
             finally:
@@ -1529,7 +2442,71 @@ class SwitchRegisterGUI:
         thread.start()
 
 
+def run_cli(argv):
+    """Command-line entry point: one register (--switch/--output) or a whole directory (--input-dir/--output-dir)"""
+    parser = argparse.ArgumentParser(
+        prog='switch aditya.py',
+        description="Process Switch Registers against Brokerage Structure files without the GUI."
+    )
+    parser.add_argument('--brokerage', nargs='+', required=True, metavar='FILE', help="Brokerage Structure file(s)")
+    parser.add_argument('--rta', metavar='FILE', help="RTA Master file (needed for registers without IN/OUT code columns)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--switch', metavar='FILE', help="one Switch Register")
+    source.add_argument('--input-dir', metavar='DIR', help="directory of Switch Registers, processed in parallel")
+    parser.add_argument('--output', metavar='FILE', help="output file for --switch (.xlsx or .csv)")
+    parser.add_argument('--output-dir', metavar='DIR', help="output directory for --input-dir")
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help="output format for --input-dir")
+    parser.add_argument('--workers', type=int, help="worker processes for --input-dir (default: one per CPU)")
+    parser.add_argument('--run-stats', action='store_true', help="also save per-stage run stats")
+    parser.add_argument('--incremental', action='store_true',
+                        help="for --switch: match only rows not processed in earlier runs with the same inputs")
+    args = parser.parse_args(argv)
+    
+    def status(text):
+        print(f"[{datetime.now():%H:%M:%S}] {text}", file=sys.stderr)
+    
+    def notify(kind, title, message):
+        print(f"{kind.upper()}: {title}: {message}", file=sys.stderr)
+    
+    if args.switch:
+        if not args.output:
+            parser.error("--switch needs --output")
+        try:
+            result = SwitchEngine(args.brokerage, args.rta, status=status).run(
+                args.switch, args.output, notify=notify, run_stats=args.run_stats, incremental=args.incremental
+            )
+        except SwitchPipelineError as e:
+            notify(e.kind, e.title, e.message)
+            return 2
+        if args.incremental:
+            status(f"Reused {result['rows_reused']} of {result['rows_read']} rows from earlier runs")
+        status(f"Wrote {result['rows_written']} rows to {result['output_path']}")
+        return 0
+    
+    if not args.output_dir:
+        parser.error("--input-dir needs --output-dir")
+    results = process_directory(args.input_dir, args.output_dir, args.brokerage, args.rta,
+                                output_format=args.format, workers=args.workers,
+                                run_stats=args.run_stats, status=status)
+    failed = 0
+    for switch_path, result in results.items():
+        name = os.path.basename(switch_path)
+        if isinstance(result, Exception):
+            failed += 1
+            notify('error', name, str(result))
+            continue
+        for kind, title, message in dict.fromkeys(result['notices']):
+            notify(kind, f"{name}: {title}", message)
+        status(f"{name}: wrote {result['rows_written']} rows to {result['output_path']}")
+    if not results:
+        status(f"No Switch Registers found in {args.input_dir}")
+    return 1 if failed else 0
+
+
 def main():
+    multiprocessing.freeze_support()  # ingestion worker processes in frozen (PyInstaller) builds
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     root = ctk.CTk()
     app = SwitchRegisterGUI(root)
     root.mainloop()